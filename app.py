@@ -1,51 +1,217 @@
 import os
+import hmac
 import logging
 import aioredis
 import asyncio
 
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import RedirectResponse, JSONResponse
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
-from fastapi_cache.decorator import cache
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Request, Query
+from fastapi.responses import RedirectResponse, JSONResponse, Response
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from service import Service
-from repository import Repository
+from repository import Repository, PoolExhaustedError
+from cache import LinkCache, CredentialCache, SharedLinkCache
+from bloom import SharedLinkFilter
+from visitors import UniqueVisitorCounter
+from hotkeys import HotLinkPinner
+from clicks import ClickRecorder
+from codes import CodeAllocator
+from sweeper import ExpirySweeper
+from partitions import StatisticsPartitionManager
+from leader import LeaderElection
+from fastpath import RedirectFastPath
+from ratelimit import RateLimit, RateLimitRule, RateLimiter, RateLimitMiddleware, client_ip
 from entity import LinkRequest, CustomLinkRequest
+from bulk import iter_bulk_items, encode_results, BulkResultsResponse
+from response_cache import ResponseCache, link_tag, url_tag
+from metrics import MetricsMiddleware, render
 
 logging.basicConfig(level=logging.INFO)
 
 my_app = FastAPI()
+my_app.add_middleware(MetricsMiddleware)
 scheduler = AsyncIOScheduler()
+scheduler.add_jobstore('memory', alias='leader')
 
 db_url = os.environ.get('DATABASE_URL')
-repo = Repository(db_url)
-service = Service(repo)
-
+repo = Repository(
+    db_url,
+    min_size=int(os.environ.get('DB_POOL_MIN_SIZE', 10)),
+    max_size=int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+    max_queries=int(os.environ.get('DB_POOL_MAX_QUERIES', 50000)),
+    max_inactive_connection_lifetime=float(os.environ.get('DB_POOL_MAX_INACTIVE_LIFETIME', 300)),
+    statement_cache_size=int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 100)),
+    acquire_timeout=float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', 1.0)),
+    max_waiting=int(os.environ.get('DB_POOL_MAX_WAITING', 100)),
+    replica_urls=[url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url],
+    max_replica_lag=float(os.environ.get('DB_REPLICA_MAX_LAG', 5)),
+    read_your_writes_seconds=float(os.environ.get('DB_READ_YOUR_WRITES_SECONDS', 5)),
+)
+replica_health_interval = float(os.environ.get('DB_REPLICA_HEALTH_INTERVAL', 5))
+pool_metrics_interval = float(os.environ.get('DB_POOL_METRICS_INTERVAL', 5))
+pool_retry_after = os.environ.get('DB_POOL_RETRY_AFTER', '1')
+link_cache = LinkCache(
+    max_size=int(os.environ.get('LINK_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('LINK_CACHE_TTL', 60)),
+    negative_ttl=float(os.environ.get('LINK_CACHE_NEGATIVE_TTL', 5)),
+)
 redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379')
 redis = aioredis.from_url(redis_url, decode_responses=True)
+visitor_counter = UniqueVisitorCounter(
+    redis,
+    secret=os.environ.get('VISITOR_HASH_SECRET', ''),
+    daily_ttl_days=float(os.environ.get('VISITORS_DAILY_RETENTION_DAYS', 90)),
+    total_ttl_days=float(os.environ.get('VISITORS_TOTAL_TTL_DAYS', 365)),
+)
+click_recorder = ClickRecorder(
+    repo,
+    max_queue_size=int(os.environ.get('CLICK_QUEUE_SIZE', 10000)),
+    batch_size=int(os.environ.get('CLICK_BATCH_SIZE', 500)),
+    flush_interval=float(os.environ.get('CLICK_FLUSH_INTERVAL', 1.0)),
+    overflow_policy=os.environ.get('CLICK_OVERFLOW_POLICY', 'drop'),
+    visitor_counter=visitor_counter,
+)
+code_allocator = CodeAllocator(repo, secret=os.environ.get('SHORT_CODE_SECRET', ''))
+credential_cache = CredentialCache(
+    max_size=int(os.environ.get('CREDENTIAL_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('CREDENTIAL_CACHE_TTL', 30)),
+)
+shared_link_cache = SharedLinkCache(
+    redis,
+    ttl=float(os.environ.get('SHARED_LINK_CACHE_TTL', 3600)),
+    negative_ttl=float(os.environ.get('LINK_CACHE_NEGATIVE_TTL', 5)),
+    tombstone_ttl=float(os.environ.get('SHARED_LINK_CACHE_TOMBSTONE_TTL', 5)),
+)
+response_cache = ResponseCache(redis)
+rate_limiter = RateLimiter(
+    redis,
+    lease_fraction=float(os.environ.get('RATE_LIMIT_LEASE_FRACTION', 0.1)),
+    lease_seconds=float(os.environ.get('RATE_LIMIT_LEASE_SECONDS', 1)),
+)
+trusted_proxies = int(os.environ.get('TRUSTED_PROXIES', 1 if os.environ.get('RATE_LIMIT_TRUST_FORWARDED') == '1' else 0))
+rate_limit_rules = [
+    RateLimitRule('create', 'POST', {
+        'user': RateLimit.parse(os.environ.get('RATE_LIMIT_CREATE_USER', '60/60')),
+        'ip': RateLimit.parse(os.environ.get('RATE_LIMIT_CREATE_IP', '120/60')),
+        'route': RateLimit.parse(os.environ.get('RATE_LIMIT_CREATE_ROUTE', '2000/1')),
+    }, paths=('/links/shorten', '/links/custom_shorten', '/links/bulk_shorten')),
+    RateLimitRule('redirect', 'GET', {
+        'ip': RateLimit.parse(os.environ.get('RATE_LIMIT_REDIRECT_IP', '600/60')),
+        'route': RateLimit.parse(os.environ.get('RATE_LIMIT_REDIRECT_ROUTE', '')),
+    }, prefix='/links/'),
+]
+link_filter = SharedLinkFilter(
+    aioredis.from_url(redis_url),
+    repo,
+    error_rate=float(os.environ.get('LINK_FILTER_ERROR_RATE', 0.01)),
+    replay_seconds=float(os.environ.get('LINK_FILTER_REPLAY_SECONDS', 600)),
+)
+link_filter_rebuild_hours = float(os.environ.get('LINK_FILTER_REBUILD_HOURS', 24))
+response_cache_ttl = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+hot_links = HotLinkPinner(
+    link_cache,
+    repo,
+    capacity=int(os.environ.get('HOT_LINKS_CAPACITY', 1000)),
+    top_k=int(os.environ.get('HOT_LINKS_TOP_K', 100)),
+    min_hits=int(os.environ.get('HOT_LINKS_MIN_HITS', 100)),
+    refresh_ahead=float(os.environ.get('HOT_LINKS_REFRESH_AHEAD', 10)),
+    decay_interval=float(os.environ.get('HOT_LINKS_DECAY_INTERVAL', 60)),
+)
+admin_token = os.environ.get('ADMIN_TOKEN')
+service = Service(repo, link_cache, click_recorder, code_allocator, credential_cache, shared_link_cache, response_cache, link_filter, visitor_counter, hot_links)
+expiry_sweep_interval_minutes = float(os.environ.get('EXPIRY_SWEEP_INTERVAL_MINUTES', 15))
+expiry_sweeper = ExpirySweeper(
+    repo,
+    on_expired=service.invalidate_links,
+    batch_size=int(os.environ.get('EXPIRY_SWEEP_BATCH_SIZE', 1000)),
+    target_batch_seconds=float(os.environ.get('EXPIRY_SWEEP_TARGET_BATCH_SECONDS', 0.2)),
+    pause_ratio=float(os.environ.get('EXPIRY_SWEEP_PAUSE_RATIO', 1.0)),
+    max_run_seconds=float(os.environ.get('EXPIRY_SWEEP_MAX_RUN_SECONDS', 30)),
+)
+
+bulk_chunk_size = int(os.environ.get('BULK_CHUNK_SIZE', 1000))
+
+click_buckets_settle_seconds = float(os.environ.get('CLICK_BUCKETS_SETTLE_SECONDS', 120))
+click_buckets_retention = {
+    'minute': timedelta(hours=float(os.environ.get('CLICK_MINUTE_BUCKETS_RETENTION_HOURS', 48))),
+    'hour': timedelta(days=float(os.environ.get('CLICK_HOUR_BUCKETS_RETENTION_DAYS', 90))),
+    'day': timedelta(days=float(os.environ.get('CLICK_DAY_BUCKETS_RETENTION_DAYS', 0))),
+}
+statistics_partitions = StatisticsPartitionManager(
+    repo,
+    days_ahead=int(os.environ.get('STATISTICS_PARTITIONS_DAYS_AHEAD', 7)),
+    retention_days=float(os.environ.get('STATISTICS_RETENTION_DAYS', 0)),
+    archive_dir=os.environ.get('STATISTICS_ARCHIVE_DIR') or None,
+)
+user_counters_reconcile_hours = float(os.environ.get('USER_COUNTERS_RECONCILE_HOURS', 24))
+link_cache_warmup_size = int(os.environ.get('LINK_CACHE_WARMUP_SIZE', 1000))
+link_cache_warmup_window = timedelta(hours=float(os.environ.get('LINK_CACHE_WARMUP_HOURS', 24)))
+
+
+def start_leader_jobs():
+    scheduler.add_job(delete_expired_links, 'interval', minutes=expiry_sweep_interval_minutes, coalesce=True, max_instances=1, jitter=30, jobstore='leader')
+    scheduler.add_job(aggregate_click_buckets, 'interval', minutes=1, jobstore='leader')
+    scheduler.add_job(prune_click_buckets, 'interval', hours=1, jobstore='leader')
+    scheduler.add_job(statistics_partitions.run, 'interval', hours=1, coalesce=True, max_instances=1, jitter=60, next_run_time=datetime.now(), jobstore='leader')
+    scheduler.add_job(reconcile_user_counters, 'interval', hours=user_counters_reconcile_hours, coalesce=True, max_instances=1, jitter=300, jobstore='leader')
+    scheduler.add_job(link_filter.rebuild, 'interval', hours=link_filter_rebuild_hours, coalesce=True, max_instances=1, jitter=300, jobstore='leader')
+
+
+def stop_leader_jobs():
+    scheduler.remove_all_jobs(jobstore='leader')
+
+
+leader_election = LeaderElection(
+    repo,
+    on_elected=start_leader_jobs,
+    on_demoted=stop_leader_jobs,
+    interval=float(os.environ.get('LEADER_CHECK_INTERVAL', 5)),
+)
 
 
 @my_app.on_event("startup")
 async def startup_event():
     await repo.connect()
     await repo.create_table()
-    FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
-    
-    scheduler.add_job(delete_expired_links, 'interval', minutes=1) 
+    await click_recorder.start()
+    await shared_link_cache.start(service.evict_local_links)
+    await link_filter.start()
+    await warm_up_link_cache()
+    await hot_links.start()
+
+    scheduler.add_job(repo.observe_pools, 'interval', seconds=pool_metrics_interval, coalesce=True, max_instances=1)
+    if repo.replicas:
+        scheduler.add_job(repo.check_replicas, 'interval', seconds=replica_health_interval, coalesce=True, max_instances=1)
     scheduler.start()
+    await leader_election.start()
 
 
 @my_app.on_event("shutdown")
 async def shutdown_event():
+    await leader_election.stop()
     scheduler.shutdown()
+    await hot_links.stop()
+    await click_recorder.stop()
+    await shared_link_cache.stop()
+    await link_filter.stop()
     await repo.close()
 
 
+@my_app.exception_handler(PoolExhaustedError)
+async def pool_exhausted_handler(request: Request, exc: PoolExhaustedError):
+    logging.warning(f"Запрос {request.url.path} отклонён: {exc}")
+    return JSONResponse(
+        content={"detail": "Service temporarily overloaded"},
+        status_code=503,
+        headers={"Retry-After": pool_retry_after},
+    )
+
+
 @my_app.post('/links/shorten')
-@cache(expire=60)
 async def create_short_link(request: Request, link_request: LinkRequest):
     user_id = request.headers.get('X-User-Id')
     token = request.headers.get('Authorization').split()[1] if request.headers.get('Authorization') else None
@@ -53,11 +219,11 @@ async def create_short_link(request: Request, link_request: LinkRequest):
     logging.info(f"Запрос от пользователя: {user_id} на создание короткой ссылки")
 
     if user_id and token:
-        user = await repo.find_user_by_token_and_id(int(user_id), token)
+        user = await service.authenticate(int(user_id), token)
         if user:
             result = await service.create_short_link(link_request.link, int(user_id), True, link_request.expires_at)
             if result:
-                return JSONResponse(content={"short_link": result['short_link']}, status_code=201)
+                return JSONResponse(content={"short_link": result['short_link']}, status_code=result['status_code'])
             else:
                 raise HTTPException(status_code=500, detail="Failed to shorten link")
         else:
@@ -65,16 +231,38 @@ async def create_short_link(request: Request, link_request: LinkRequest):
     else:
         result = await service.create_short_link(link_request.link, None, False, link_request.expires_at)
         if result:
-            return JSONResponse(content={"short_link": result['short_link']}, status_code=201)
+            return JSONResponse(content={"short_link": result['short_link']}, status_code=result['status_code'])
         else:
             raise HTTPException(status_code=500, detail="Failed to shorten link")
 
 
+@my_app.post('/links/bulk_shorten')
+async def create_short_links_bulk(request: Request):
+    user_id = request.headers.get('X-User-Id')
+    token = request.headers.get('Authorization').split()[1] if request.headers.get('Authorization') else None
+
+    logging.info(f"Запрос от пользователя: {user_id} на массовое создание коротких ссылок")
+
+    is_authorized = False
+    if user_id and token:
+        user = await service.authenticate(int(user_id), token)
+        if not user:
+            raise HTTPException(status_code=401, detail="Unauthorized")
+        is_authorized = True
+    else:
+        user_id = None
+
+    items = iter_bulk_items(request.stream(), request.headers.get('Content-Type', ''))
+    results = service.create_short_links_bulk(items, int(user_id) if user_id else None, is_authorized, bulk_chunk_size)
+    return BulkResultsResponse(encode_results(results))
+
+
 @my_app.get('/links/{short_code}')
-@cache(expire=60)
-async def redirect_to_original_url(short_code: str):
-    logging.info(f"Запрос на переход по короткой ссылке: {short_code}")
-    original_url = await service.get_original_url(short_code)
+async def redirect_to_original_url(short_code: str, request: Request):
+    logging.debug("Запрос на переход по короткой ссылке: %s", short_code)
+    original_url = await service.get_original_url(
+        short_code, client_ip(request.scope, trusted_proxies), request.headers.get('User-Agent')
+    )
     if original_url:
         return RedirectResponse(url=original_url, status_code=302)
     else:
@@ -83,7 +271,6 @@ async def redirect_to_original_url(short_code: str):
 
 
 @my_app.delete('/links/{short_code}')
-@cache(expire=0)
 async def delete_link(short_code: str, request: Request):
     user_id = request.headers.get('X-User-Id')
     token = request.headers.get('Authorization').split()[1] if request.headers.get('Authorization') else None
@@ -92,7 +279,6 @@ async def delete_link(short_code: str, request: Request):
 
     if user_id and token:
         if await service.delete_link(short_code, int(user_id), token):
-            await redis.delete(f"fastapi-cache:{short_code}")
             return {"message": "Link has been deleted"}
         else:
             raise HTTPException(status_code=403, detail="Forbidden")
@@ -101,7 +287,6 @@ async def delete_link(short_code: str, request: Request):
 
 
 @my_app.put('/links/{short_code}')
-@cache(expire=0)
 async def update_link(short_code: str, request: Request, link_request: LinkRequest):
     user_id = request.headers.get('X-User-Id')
     token = request.headers.get('Authorization').split()[1] if request.headers.get('Authorization') else None
@@ -110,7 +295,6 @@ async def update_link(short_code: str, request: Request, link_request: LinkReque
     
     if user_id and token:
         if await service.update_url(short_code, link_request.link, int(user_id), token):
-            await redis.delete(f"fastapi-cache:{short_code}")
             return {"message": "Link has been updated"}
         else:
             raise HTTPException(status_code=403, detail="Forbidden")
@@ -119,7 +303,7 @@ async def update_link(short_code: str, request: Request, link_request: LinkReque
 
 
 @my_app.get('/links/{short_code}/stats')
-@cache(expire=60)
+@response_cache.cached(expire=response_cache_ttl, per_user=True, tags=lambda params, content: [link_tag(params['short_code'])])
 async def get_stats(short_code: str, request: Request):
     user_id = request.headers.get('X-User-Id')
     token = request.headers.get('Authorization').split()[1] if request.headers.get('Authorization') else None
@@ -139,12 +323,57 @@ async def get_stats(short_code: str, request: Request):
     if stats is None:
         raise HTTPException(status_code=403, detail="Stats not found")
     
-    return JSONResponse(content=stats, media_type="application/json")
+    return stats
+
+
+
+@my_app.get('/links/{short_code}/stats/clicks')
+async def get_click_histogram(short_code: str, request: Request, granularity: str = 'hour', start: Optional[datetime] = None, end: Optional[datetime] = None):
+    user_id = request.headers.get('X-User-Id')
+    token = request.headers.get('Authorization').split()[1] if request.headers.get('Authorization') else None
+
+    logging.info(f"Запрос от пользователя: {user_id} на предоставление истории переходов по коду: {short_code}")
+
+    if not user_id or not token:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    try:
+        user_id_int = int(user_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+
+    histogram = await service.get_click_histogram(short_code, user_id_int, token, granularity, start, end)
+
+    if histogram is None:
+        raise HTTPException(status_code=403, detail="Stats not found")
 
+    return JSONResponse(content=histogram, media_type="application/json")
+
+
+@my_app.get('/links/{short_code}/stats/visitors')
+async def get_unique_visitors(short_code: str, request: Request, start: Optional[date] = None, end: Optional[date] = None):
+    user_id = request.headers.get('X-User-Id')
+    token = request.headers.get('Authorization').split()[1] if request.headers.get('Authorization') else None
+
+    logging.info(f"Запрос от пользователя: {user_id} на предоставление уникальных посетителей по коду: {short_code}")
+
+    if not user_id or not token:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    try:
+        user_id_int = int(user_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+
+    visitors = await service.get_unique_visitors(short_code, user_id_int, token, start, end)
+
+    if visitors is None:
+        raise HTTPException(status_code=403, detail="Stats not found")
+
+    return visitors
 
 
 @my_app.post('/links/custom_shorten')
-@cache(expire=60)
 async def create_custom_short_link(request: Request, link_request: CustomLinkRequest):
     user_id = request.headers.get('X-User-Id')
     token = request.headers.get('Authorization').split()[1] if request.headers.get('Authorization') else None
@@ -152,7 +381,7 @@ async def create_custom_short_link(request: Request, link_request: CustomLinkReq
     logging.info(f"Запрос от пользователя: {user_id} на создание короткой ссылки с кастомным алиасом")
 
     if user_id and token:
-        user = await repo.find_user_by_token_and_id(int(user_id), token)
+        user = await service.authenticate(int(user_id), token)
         if user:
             result = await service.create_short_link_with_custom_alias(link_request.link, link_request.custom_alias, int(user_id), True, link_request.expires_at)
             if result:
@@ -170,26 +399,32 @@ async def create_custom_short_link(request: Request, link_request: CustomLinkReq
 
 
 @my_app.get('/search')
-@cache(expire=60)
-async def search_link_by_original_url(original_url: str):
+@response_cache.cached(
+    expire=response_cache_ttl,
+    tags=lambda params, content: [url_tag(params['original_url']), *(link_tag(short_link) for short_link in content['short_links'])],
+)
+async def search_link_by_original_url(request: Request, original_url: str, limit: int = Query(20, ge=1, le=100), offset: int = Query(0, ge=0)):
 
     logging.info(f"Запрос на поиск ссылки {original_url}")
 
     if not original_url:
         raise HTTPException(status_code=400, detail="Original URL is required")
     
-    result = await service.find_short_link_by_original_url(original_url)
+    short_links = await service.find_short_links_by_original_url(original_url, limit, offset)
     
-    if result:
+    if short_links:
         return {
-            "short_link": result['short_link']
+            "short_link": short_links[0],
+            "short_links": short_links,
+            "limit": limit,
+            "offset": offset
         }
     else:
         raise HTTPException(status_code=404, detail="Link not found")
 
 
 @my_app.get('/overview')
-@cache(expire=60)
+@response_cache.cached(expire=response_cache_ttl, per_user=True)
 async def get_links_overview(request: Request):
     user_id = request.headers.get('X-User-Id')
     token = request.headers.get('Authorization').split()[1] if request.headers.get('Authorization') else None
@@ -197,12 +432,58 @@ async def get_links_overview(request: Request):
     logging.info(f"Запрос от пользователя: {user_id} на получение статистики ссылок")
 
     if user_id and token:
-        user = await repo.find_user_by_token_and_id(int(user_id), token)
+        user = await service.authenticate(int(user_id), token)
         if user:
             return await service.get_links_overview(user_id)
         else:
             raise HTTPException(status_code=401, detail="Unauthorized")
  
 
+@my_app.get('/admin/hot-links')
+async def get_hot_links(request: Request, limit: Optional[int] = Query(None, ge=1, le=1000)):
+    authorization = request.headers.get('Authorization', '').split()
+    token = authorization[1] if len(authorization) == 2 else None
+    if not admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token or not hmac.compare_digest(token.encode(), admin_token.encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    return {"hot_links": hot_links.top(limit)}
+
+
+@my_app.get('/metrics')
+async def get_metrics():
+    content, media_type = render()
+    return Response(content=content, media_type=media_type)
+
+
 async def delete_expired_links():
-    await repo.delete_expired_links()
\ No newline at end of file
+    await expiry_sweeper.run()
+
+
+async def aggregate_click_buckets():
+    await repo.aggregate_click_buckets(click_buckets_settle_seconds)
+
+
+async def prune_click_buckets():
+    await repo.prune_click_buckets(click_buckets_retention)
+
+
+async def warm_up_link_cache():
+    try:
+        await service.warm_up_link_cache(link_cache_warmup_size, link_cache_warmup_window)
+    except Exception:
+        logging.exception("Не удалось прогреть кэш ссылок, сервис стартует с пустым кэшем")
+
+
+async def reconcile_user_counters():
+    users_count = await repo.reconcile_user_counters()
+    if users_count:
+        logging.warning(f"Счётчики ссылок разошлись с данными у {users_count} пользователей и были исправлены")
+
+
+fast_path = RedirectFastPath(my_app, service, retry_after=pool_retry_after, trusted_proxies=trusted_proxies)
+if os.environ.get('RATE_LIMIT_ENABLED', '1') == '1':
+    app = RateLimitMiddleware(fast_path, rate_limiter, rate_limit_rules, trusted_proxies=trusted_proxies, authenticate=service.authenticate)
+else:
+    app = fast_path
@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as application
+
+CODE_PREFIX = 'bench'
+
+
+def make_scope(path: str) -> dict:
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0', 'spec_version': '2.3'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': b'',
+        'headers': [(b'host', b'localhost:8000')],
+        'client': ('127.0.0.1', 50000),
+        'server': ('127.0.0.1', 8000),
+    }
+
+
+async def receive():
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+
+async def measure(asgi_app, paths: list, requests: int) -> dict:
+    statuses = {}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses[message['status']] = statuses.get(message['status'], 0) + 1
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(requests):
+        request_started = time.perf_counter()
+        await asgi_app(make_scope(paths[i % len(paths)]), receive, send)
+        latencies.append(time.perf_counter() - request_started)
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'statuses': statuses,
+        'rps': round(requests / duration),
+        'mean_us': round(statistics.fmean(latencies) * 1e6, 1),
+        'p50_us': round(latencies[len(latencies) // 2] * 1e6, 1),
+        'p99_us': round(latencies[int(len(latencies) * 0.99)] * 1e6, 1),
+    }
+
+
+async def run(args):
+    codes = [f"{CODE_PREFIX}{i}" for i in range(args.links)]
+    for code in codes:
+        application.link_cache.set(code, f"https://example.com/bench/{code}?utm_source=bench")
+    paths = [f"/links/{code}" for code in codes]
+
+    results = {}
+    for name, asgi_app in (('fastapi_route', application.my_app), ('fast_path', application.fast_path)):
+        await measure(asgi_app, paths, args.warmup)
+        application.click_recorder.queue = asyncio.Queue(maxsize=args.requests + args.warmup)
+        results[name] = await measure(asgi_app, paths, args.requests)
+
+    results['speedup'] = round(results['fastapi_route']['mean_us'] / results['fast_path']['mean_us'], 2)
+    print(json.dumps(results, indent=2))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="In-process comparison of the FastAPI redirect route and the ASGI fast path on cache hits")
+    parser.add_argument('--links', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=50000)
+    parser.add_argument('--warmup', type=int, default=5000)
+    return parser
+
+
+if __name__ == "__main__":
+    asyncio.run(run(build_parser().parse_args()))
@@ -0,0 +1,265 @@
+import math
+import json
+import time
+import asyncio
+import hashlib
+import logging
+
+from collections import deque
+from typing import Iterable, Optional
+
+from metrics import LINK_FILTER_ITEMS, LINK_FILTER_READY
+
+logging.basicConfig(level=logging.INFO)
+
+
+class BloomFilter:
+    def __init__(self, size_bits: int, hashes: int, bits: Optional[bytes] = None):
+        self.size_bits = size_bits
+        self.hashes = hashes
+        self.bits = bytearray(bits) if bits is not None else bytearray((size_bits + 7) // 8)
+
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float = 0.01) -> 'BloomFilter':
+        capacity = max(capacity, 1)
+        size_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        hashes = max(1, round(size_bits / capacity * math.log(2)))
+        return cls(size_bits, hashes)
+
+
+    def offsets(self, item: str) -> list:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:], 'big') | 1
+        return [(first + i * second) % self.size_bits for i in range(self.hashes)]
+
+
+    def add(self, item: str):
+        for offset in self.offsets(item):
+            self.bits[offset >> 3] |= 0x80 >> (offset & 7)
+
+
+    def __contains__(self, item: str) -> bool:
+        for offset in self.offsets(item):
+            if not self.bits[offset >> 3] & (0x80 >> (offset & 7)):
+                return False
+        return True
+
+
+class SharedLinkFilter:
+    def __init__(self, redis, repository, error_rate: float = 0.01, growth: float = 2.0, min_capacity: int = 100000,
+                 replay_seconds: float = 600, key: str = 'link-filter', channel: str = 'link-filter-updates'):
+        self.redis = redis
+        self.repository = repository
+        self.error_rate = error_rate
+        self.growth = growth
+        self.min_capacity = min_capacity
+        self.replay_seconds = replay_seconds
+        self.key = key
+        self.meta_key = key + ':meta'
+        self.lock_key = key + ':lock'
+        self.channel = channel
+        self.filter = None
+        self.version = None
+        self.items = 0
+        self.recent = deque()
+        self.pending = []
+        self.rebuilding = False
+        self._task = None
+        self._loader = None
+        self._recovery = None
+
+
+    def might_contain(self, short_code: str) -> bool:
+        return self.filter is None or short_code in self.filter
+
+
+    async def add_many(self, short_codes: Iterable[str]):
+        short_codes = list(short_codes)
+        if not short_codes:
+            return
+        self._add_local(short_codes)
+        try:
+            await self._publish(short_codes)
+        except Exception:
+            logging.exception(f"Не удалось добавить {len(short_codes)} кодов в общий фильтр ссылок, проверка отключена до восстановления")
+            self.pending += short_codes
+            self.filter = None
+            LINK_FILTER_READY.set(0)
+            if self._recovery is None or self._recovery.done():
+                self._recovery = asyncio.create_task(self._recover())
+
+
+    async def _publish(self, short_codes: list):
+        bloom = self.filter
+        pipeline = self.redis.pipeline(transaction=False)
+        if bloom is not None:
+            self._set_bits(pipeline, bloom, short_codes)
+        pipeline.publish(self.channel, json.dumps({"add": short_codes}))
+        await pipeline.execute()
+
+
+    async def _recover(self):
+        delay = 0.1
+        while self.pending:
+            await asyncio.sleep(delay)
+            pending = list(self.pending)
+            try:
+                if await self.load():
+                    for short_code in pending:
+                        self.filter.add(short_code)
+                await self._publish(pending)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Не удалось повторно отправить {len(pending)} кодов в общий фильтр ссылок: {e}")
+                delay = min(delay * 2, 10)
+                continue
+            del self.pending[:len(pending)]
+        logging.info("Общий фильтр ссылок восстановлен после ошибки Redis")
+
+
+    def _set_bits(self, pipeline, bloom: BloomFilter, short_codes: Iterable[str]):
+        for short_code in short_codes:
+            for offset in bloom.offsets(short_code):
+                pipeline.setbit(self.key, offset, 1)
+
+
+    def _add_local(self, short_codes: Iterable[str]):
+        now = time.monotonic()
+        for short_code in short_codes:
+            self.recent.append((now, short_code))
+            if self.filter is not None:
+                self.filter.add(short_code)
+                self.items += 1
+        while not self.rebuilding and self.recent and self.recent[0][0] < now - self.replay_seconds:
+            self.recent.popleft()
+        LINK_FILTER_ITEMS.set(self.items)
+
+
+    async def _swap(self, bloom: BloomFilter, version: int, items: int):
+        replayed = [short_code for _, short_code in self.recent]
+        for short_code in replayed:
+            bloom.add(short_code)
+        self.filter = bloom
+        self.version = version
+        self.items = items + len(replayed)
+        LINK_FILTER_READY.set(1)
+        LINK_FILTER_ITEMS.set(self.items)
+
+        if replayed:
+            pipeline = self.redis.pipeline(transaction=False)
+            self._set_bits(pipeline, bloom, replayed)
+            await pipeline.execute()
+
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+        if self._loader is None:
+            self._loader = asyncio.create_task(self._load_or_rebuild())
+
+
+    async def stop(self):
+        for task in (self._task, self._loader, self._recovery):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._loader = None
+        self._recovery = None
+
+
+    async def _load_or_rebuild(self):
+        try:
+            while not await self.load():
+                if await self.rebuild():
+                    break
+                await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("Не удалось подготовить фильтр коротких ссылок, проверка отключена")
+
+
+    async def load(self) -> bool:
+        pipeline = self.redis.pipeline(transaction=True)
+        pipeline.get(self.meta_key)
+        pipeline.get(self.key)
+        meta, bits = await pipeline.execute()
+        if meta is None or bits is None:
+            return False
+
+        meta = json.loads(meta)
+        size_bytes = (meta['size_bits'] + 7) // 8
+        bloom = BloomFilter(meta['size_bits'], meta['hashes'], bits[:size_bytes].ljust(size_bytes, b'\0'))
+        await self._swap(bloom, meta['version'], meta['items'])
+        logging.info(f"Фильтр коротких ссылок загружен из Redis: версия {self.version}, {self.items} кодов")
+        return True
+
+
+    async def rebuild(self, lock_seconds: float = 3600) -> bool:
+        if not await self.redis.set(self.lock_key, 1, nx=True, ex=int(lock_seconds)):
+            return False
+
+        self.rebuilding = True
+        try:
+            count = await self.repository.count_links()
+            bloom = BloomFilter.for_capacity(max(self.min_capacity, int(count * self.growth)), self.error_rate)
+            items = 0
+            async for short_links in self.repository.iter_short_links():
+                for short_link in short_links:
+                    bloom.add(short_link)
+                items += len(short_links)
+                await asyncio.sleep(0)
+
+            meta = await self.redis.get(self.meta_key)
+            version = max(self.version or 0, json.loads(meta)['version'] if meta is not None else 0) + 1
+            pipeline = self.redis.pipeline(transaction=True)
+            pipeline.set(self.key, bytes(bloom.bits))
+            pipeline.set(self.meta_key, json.dumps({
+                "size_bits": bloom.size_bits, "hashes": bloom.hashes, "version": version, "items": items,
+            }))
+            pipeline.publish(self.channel, json.dumps({"reload": version}))
+            await pipeline.execute()
+            await self._swap(bloom, version, items)
+        finally:
+            self.rebuilding = False
+            await self.redis.delete(self.lock_key)
+
+        logging.info(f"Фильтр коротких ссылок перестроен: версия {version}, {items} кодов, {bloom.size_bits} бит")
+        return True
+
+
+    async def _listen(self):
+        delay = 0.1
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                if self.filter is not None:
+                    await self.load()
+                delay = 0.1
+                async for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    update = json.loads(message['data'])
+                    if 'add' in update:
+                        self._add_local(update['add'])
+                    elif update['reload'] != self.version:
+                        await self.load()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception(f"Подписка на канал {self.channel} прервана, повтор через {delay} с")
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10)
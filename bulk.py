@@ -0,0 +1,119 @@
+import json
+import codecs
+
+from typing import AsyncIterator
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+
+from entity import LinkRequest, CustomLinkRequest
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+MAX_ITEM_SIZE = 64 * 1024
+
+
+class BulkParseError(ValueError):
+    pass
+
+
+def parse_link_item(payload):
+    if not isinstance(payload, dict):
+        raise BulkParseError("Item must be a JSON object")
+    try:
+        if payload.get('custom_alias') is not None:
+            return CustomLinkRequest(**payload)
+        return LinkRequest(**payload)
+    except ValidationError as e:
+        raise BulkParseError(e.errors()[0]['msg'])
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]):
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if line.strip():
+                yield _decode_line(line)
+        if len(buffer) > MAX_ITEM_SIZE:
+            raise BulkParseError("Item is too large")
+    if buffer.strip():
+        yield _decode_line(buffer)
+
+
+def _decode_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return BulkParseError(f"Invalid JSON: {e}")
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]):
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    started = finished = False
+
+    async for chunk in chunks:
+        buffer += text_decoder.decode(chunk)
+        position = 0
+        while not finished:
+            while position < len(buffer) and (buffer[position].isspace() or (started and buffer[position] == ',')):
+                position += 1
+            if position >= len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise BulkParseError("Request body must be a JSON array")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                finished = True
+                break
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                break
+            if end == len(buffer) and not isinstance(item, (dict, list)):
+                break
+            yield item
+            position = end
+
+        buffer = buffer[position:]
+        if len(buffer) > MAX_ITEM_SIZE:
+            raise BulkParseError("Item is too large or malformed")
+
+    if not finished:
+        raise BulkParseError("Unexpected end of JSON array")
+
+
+async def iter_bulk_items(chunks: AsyncIterator[bytes], content_type: str):
+    if content_type.split(';')[0].strip() in NDJSON_CONTENT_TYPES:
+        items = iter_ndjson(chunks)
+    else:
+        items = iter_json_array(chunks)
+
+    index = 0
+    async for payload in items:
+        if isinstance(payload, BulkParseError):
+            yield index, payload
+        else:
+            try:
+                yield index, parse_link_item(payload)
+            except BulkParseError as e:
+                yield index, e
+        index += 1
+
+
+class BulkResultsResponse(StreamingResponse):
+    media_type = 'application/x-ndjson'
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def encode_results(results):
+    async for result in results:
+        yield json.dumps(result) + '\n'
@@ -0,0 +1,274 @@
+import time
+import json
+import asyncio
+import hashlib
+import logging
+
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+from metrics import SHARED_LINK_CACHE_HIT, SHARED_LINK_CACHE_MISS
+
+logging.basicConfig(level=logging.INFO)
+
+MISSING = object()
+TOMBSTONE = '-'
+
+
+class LinkCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 60, negative_ttl: float = 5):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._pinned = {}
+
+
+    def get(self, short_code: str):
+        entry = self._pinned.get(short_code)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                return entry[0]
+            self._pinned.pop(short_code, None)
+
+        entry = self._entries.get(short_code)
+        if entry is None:
+            return MISSING
+
+        full_link, deadline = entry
+        if deadline <= time.monotonic():
+            self._entries.pop(short_code, None)
+            return MISSING
+
+        self._entries.move_to_end(short_code)
+        return full_link
+
+
+    def _deadline(self, full_link: Optional[str], expires_in: Optional[float]) -> Optional[float]:
+        ttl = self.ttl if full_link is not None else self.negative_ttl
+        if expires_in is not None:
+            ttl = min(ttl, expires_in)
+        return time.monotonic() + ttl if ttl > 0 else None
+
+
+    def set(self, short_code: str, full_link: Optional[str], expires_in: Optional[float] = None):
+        deadline = self._deadline(full_link, expires_in)
+        if short_code in self._pinned:
+            if deadline is None or full_link is None:
+                self._pinned.pop(short_code, None)
+            else:
+                self._pinned[short_code] = (full_link, deadline)
+                return
+
+        if deadline is None:
+            self._entries.pop(short_code, None)
+            return
+
+        self._entries[short_code] = (full_link, deadline)
+        self._entries.move_to_end(short_code)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+    def pin(self, short_code: str) -> bool:
+        entry = self._entries.get(short_code)
+        if entry is None or entry[0] is None or entry[1] <= time.monotonic():
+            return False
+        self._pinned[short_code] = self._entries.pop(short_code)
+        return True
+
+
+    def unpin(self, short_code: str):
+        entry = self._pinned.pop(short_code, None)
+        if entry is not None and entry[1] > time.monotonic():
+            self.set(short_code, entry[0], entry[1] - time.monotonic())
+
+
+    def refresh_pinned(self, short_code: str, previous: tuple, full_link: Optional[str], expires_in: Optional[float]) -> bool:
+        if self._pinned.get(short_code) is not previous:
+            return False
+        deadline = self._deadline(full_link, expires_in)
+        if full_link is None or deadline is None:
+            self._pinned.pop(short_code, None)
+        else:
+            self._pinned[short_code] = (full_link, deadline)
+        return True
+
+
+    def pinned(self) -> dict:
+        return dict(self._pinned)
+
+
+    def invalidate(self, short_code: str):
+        self._entries.pop(short_code, None)
+        self._pinned.pop(short_code, None)
+
+
+    def invalidate_many(self, short_codes: Iterable[str]):
+        for short_code in short_codes:
+            self._entries.pop(short_code, None)
+            self._pinned.pop(short_code, None)
+
+
+    def clear(self, keep_pinned: bool = False):
+        self._entries.clear()
+        if not keep_pinned:
+            self._pinned.clear()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CredentialCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+
+    @staticmethod
+    def _key(user_id: int, token: str):
+        return user_id, hashlib.sha256(token.encode()).digest()
+
+
+    def get(self, user_id: int, token: str):
+        key = self._key(user_id, token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        user, deadline = entry
+        if deadline <= time.monotonic():
+            self._entries.pop(key, None)
+            return None
+
+        self._entries.move_to_end(key)
+        return user
+
+
+    def set(self, user_id: int, token: str, user: dict):
+        key = self._key(user_id, token)
+        self._entries[key] = (user, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+    def invalidate_user(self, user_id: int):
+        for key in [key for key in self._entries if key[0] == user_id]:
+            del self._entries[key]
+
+
+    def clear(self):
+        self._entries.clear()
+
+
+class SharedLinkCache:
+    def __init__(self, redis, ttl: float = 3600, negative_ttl: float = 5, tombstone_ttl: float = 5,
+                 prefix: str = 'link:', channel: str = 'link-cache-invalidation'):
+        self.redis = redis
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.tombstone_ttl = tombstone_ttl
+        self.prefix = prefix
+        self.channel = channel
+        self._on_invalidate = None
+        self._subscribed = asyncio.Event()
+        self._task = None
+
+
+    async def get(self, short_code: str):
+        try:
+            value = await self.redis.get(self.prefix + short_code)
+        except Exception:
+            logging.exception(f"Не удалось прочитать ссылку {short_code} из Redis")
+            return MISSING
+
+        if value is None or value == TOMBSTONE:
+            SHARED_LINK_CACHE_MISS.inc()
+            return MISSING
+
+        SHARED_LINK_CACHE_HIT.inc()
+        entry = json.loads(value)
+        expires_at = entry.get('expires_at')
+        return entry['full_link'], expires_at - time.time() if expires_at is not None else None
+
+
+    async def set(self, short_code: str, full_link: Optional[str], expires_in: Optional[float] = None):
+        ttl = self.ttl if full_link is not None else self.negative_ttl
+        if expires_in is not None:
+            ttl = min(ttl, expires_in)
+        if ttl <= 0:
+            return
+
+        value = json.dumps({
+            'full_link': full_link,
+            'expires_at': time.time() + expires_in if expires_in is not None else None,
+        })
+        try:
+            await self.redis.set(self.prefix + short_code, value, px=int(ttl * 1000), nx=True)
+        except Exception:
+            logging.exception(f"Не удалось сохранить ссылку {short_code} в Redis")
+
+
+    async def invalidate_many(self, short_codes: Iterable[str]):
+        short_codes = list(short_codes)
+        if not short_codes:
+            return
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for short_code in short_codes:
+                pipeline.set(self.prefix + short_code, TOMBSTONE, px=int(self.tombstone_ttl * 1000))
+            pipeline.publish(self.channel, json.dumps(short_codes))
+            await pipeline.execute()
+        except Exception:
+            logging.exception(f"Не удалось разослать инвалидацию {len(short_codes)} ссылок")
+
+
+    async def start(self, on_invalidate: Callable[[Optional[Iterable[str]]], None], subscribe_timeout: float = 5):
+        self._on_invalidate = on_invalidate
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), subscribe_timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Подписка на канал {self.channel} не готова за {subscribe_timeout} с, продолжаем без неё")
+
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+    async def _listen(self):
+        delay = 0.1
+        reconnected = False
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                if reconnected:
+                    self._on_invalidate(None)
+                self._subscribed.set()
+                delay = 0.1
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._on_invalidate(json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception(f"Подписка на канал {self.channel} прервана, повтор через {delay} с")
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+            reconnected = True
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10)
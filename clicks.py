@@ -0,0 +1,96 @@
+import asyncio
+import logging
+
+from datetime import datetime, timezone
+
+from typing import Optional
+
+from repository import Repository
+from visitors import UniqueVisitorCounter
+from metrics import CLICK_QUEUE_DEPTH, CLICKS_DROPPED, CLICKS_FAILED, CLICKS_WRITTEN
+
+logging.basicConfig(level=logging.INFO)
+
+OVERFLOW_POLICIES = ('drop', 'drop_oldest', 'block')
+
+
+class ClickRecorder:
+    def __init__(self, repository: Repository, max_queue_size: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 1.0, overflow_policy: str = 'drop', visitor_counter: Optional[UniqueVisitorCounter] = None):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+
+        self.repository = repository
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.visitor_counter = visitor_counter
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.dropped = 0
+        self.failed = 0
+        self._batch_ready = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+
+    async def record(self, short_code: str, visitor_hash: Optional[int] = None):
+        event = (short_code, datetime.now(timezone.utc).replace(tzinfo=None), visitor_hash)
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            if self.overflow_policy == 'block':
+                await self.queue.put(event)
+            elif self.overflow_policy == 'drop_oldest':
+                self.queue.get_nowait()
+                self.queue.put_nowait(event)
+                self.dropped += 1
+                CLICKS_DROPPED.inc()
+            else:
+                self.dropped += 1
+                CLICKS_DROPPED.inc()
+
+        if self.queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            self._batch_ready.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self.flush()
+
+
+    async def flush(self):
+        CLICK_QUEUE_DEPTH.set(self.queue.qsize())
+        while not self.queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self.repository.save_access_statistics_batch(batch)
+                CLICKS_WRITTEN.inc(len(batch))
+            except Exception:
+                self.failed += len(batch)
+                CLICKS_FAILED.inc(len(batch))
+                logging.exception(f"Не удалось сохранить статистику переходов: {len(batch)} записей")
+                continue
+            if self.visitor_counter is not None:
+                await self.visitor_counter.add_many(batch)
+
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
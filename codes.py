@@ -0,0 +1,79 @@
+import asyncio
+import hashlib
+import string
+
+from repository import Repository
+
+ALPHABET = string.digits + string.ascii_letters
+CODE_LENGTH = 6
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH
+
+FEISTEL_HALF_BITS = 18
+FEISTEL_ROUNDS = 4
+
+
+def encode_base62(number: int, length: int = CODE_LENGTH) -> str:
+    chars = []
+    while number:
+        number, remainder = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[remainder])
+    return ''.join(reversed(chars)).rjust(length, ALPHABET[0])
+
+
+class CodeScrambler:
+    def __init__(self, secret: str = ''):
+        self.keys = [
+            hashlib.blake2b(f"{secret}:{round_number}".encode(), digest_size=16).digest()
+            for round_number in range(FEISTEL_ROUNDS)
+        ]
+        self.half_mask = (1 << FEISTEL_HALF_BITS) - 1
+
+
+    def _round(self, key: bytes, value: int) -> int:
+        digest = hashlib.blake2b(value.to_bytes(3, 'big'), key=key, digest_size=3).digest()
+        return int.from_bytes(digest, 'big') & self.half_mask
+
+
+    def _permute(self, value: int) -> int:
+        left, right = value >> FEISTEL_HALF_BITS, value & self.half_mask
+        for key in self.keys:
+            left, right = right, left ^ self._round(key, right)
+        return (left << FEISTEL_HALF_BITS) | right
+
+
+    def scramble(self, value: int) -> int:
+        value = self._permute(value)
+        while value >= CODE_SPACE:
+            value = self._permute(value)
+        return value
+
+
+class CodeAllocator:
+    def __init__(self, repository: Repository, secret: str = ''):
+        self.repository = repository
+        self.scrambler = CodeScrambler(secret)
+        self._next_id = 0
+        self._block_end = 0
+        self._lock = asyncio.Lock()
+
+
+    def encode(self, code_id: int) -> str:
+        if code_id >= CODE_SPACE:
+            return encode_base62(code_id)
+        return encode_base62(self.scrambler.scramble(code_id))
+
+
+    async def next_code(self) -> str:
+        if self._next_id >= self._block_end:
+            async with self._lock:
+                if self._next_id >= self._block_end:
+                    block_start, block_size = await self.repository.reserve_code_block()
+                    self._next_id, self._block_end = block_start, block_start + block_size
+
+        code_id = self._next_id
+        self._next_id += 1
+        return self.encode(code_id)
+
+
+    async def next_codes(self, count: int) -> list:
+        return [await self.next_code() for _ in range(count)]
@@ -0,0 +1,2 @@
+#!/bin/sh
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,82 @@
+import time
+
+from urllib.parse import quote
+
+from service import Service
+from repository import PoolExhaustedError
+from ratelimit import client_ip
+from metrics import REQUEST_LATENCY
+
+REDIRECT_ROUTE = '/links/{short_code}'
+LOCATION_SAFE_CHARACTERS = ":/%#?=@[]!$&'()*+,;"
+
+NOT_FOUND_BODY = b'{"detail":"Link not found"}'
+OVERLOADED_BODY = b'{"detail":"Service temporarily overloaded"}'
+
+REDIRECT_HEADERS = [(b'content-length', b'0')]
+NOT_FOUND_START = {
+    'type': 'http.response.start',
+    'status': 404,
+    'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(NOT_FOUND_BODY)).encode())],
+}
+NOT_FOUND_BODY_MESSAGE = {'type': 'http.response.body', 'body': NOT_FOUND_BODY}
+OVERLOADED_BODY_MESSAGE = {'type': 'http.response.body', 'body': OVERLOADED_BODY}
+EMPTY_BODY_MESSAGE = {'type': 'http.response.body', 'body': b''}
+
+REDIRECT_LATENCY = REQUEST_LATENCY.labels('GET', REDIRECT_ROUTE, 302)
+NOT_FOUND_LATENCY = REQUEST_LATENCY.labels('GET', REDIRECT_ROUTE, 404)
+OVERLOADED_LATENCY = REQUEST_LATENCY.labels('GET', REDIRECT_ROUTE, 503)
+
+
+class RedirectFastPath:
+    def __init__(self, app, service: Service, prefix: str = '/links/', retry_after: str = '1', trusted_proxies: int = 0):
+        self.app = app
+        self.service = service
+        self.prefix = prefix
+        self.trusted_proxies = trusted_proxies
+        self.overloaded_start = {
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(OVERLOADED_BODY)).encode()),
+                (b'retry-after', retry_after.encode()),
+            ],
+        }
+
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            await self.app(scope, receive, send)
+            return
+
+        path = scope['path']
+        if not path.startswith(self.prefix) or '/' in path[len(self.prefix):] or len(path) == len(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        user_agent = next((value for name, value in scope['headers'] if name == b'user-agent'), b'')
+        try:
+            full_link = await self.service.get_original_url(
+                path[len(self.prefix):], client_ip(scope, self.trusted_proxies), user_agent.decode('latin-1')
+            )
+        except PoolExhaustedError:
+            await send(self.overloaded_start)
+            await send(OVERLOADED_BODY_MESSAGE)
+            OVERLOADED_LATENCY.observe(time.perf_counter() - started)
+            return
+
+        if full_link is None:
+            await send(NOT_FOUND_START)
+            await send(NOT_FOUND_BODY_MESSAGE)
+            NOT_FOUND_LATENCY.observe(time.perf_counter() - started)
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 302,
+            'headers': [(b'location', quote(full_link, safe=LOCATION_SAFE_CHARACTERS).encode('latin-1')), *REDIRECT_HEADERS],
+        })
+        await send(EMPTY_BODY_MESSAGE)
+        REDIRECT_LATENCY.observe(time.perf_counter() - started)
@@ -0,0 +1,151 @@
+import time
+import heapq
+import asyncio
+import logging
+
+from typing import Hashable, Optional
+
+from cache import LinkCache
+from repository import Repository
+from metrics import HOT_LINKS_PINNED, HOT_LINK_REFRESHES
+
+logging.basicConfig(level=logging.INFO)
+
+
+class SpaceSaving:
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self._heap = []
+
+
+    def add(self, item: Hashable, count: int = 1):
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            evicted, evicted_count = self._pop_min()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.counts[item] = evicted_count + count
+            self.errors[item] = evicted_count
+
+        heapq.heappush(self._heap, (self.counts[item], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild()
+
+
+    def _pop_min(self) -> tuple:
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if self.counts.get(item) == count:
+                return item, count
+
+
+    def _rebuild(self):
+        self._heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+
+    def top(self, k: int) -> list:
+        return [
+            (item, count, self.errors[item])
+            for item, count in sorted(self.counts.items(), key=lambda pair: pair[1], reverse=True)[:k]
+        ]
+
+
+    def decay(self, factor: float = 0.5):
+        for item in list(self.counts):
+            self.counts[item] = int(self.counts[item] * factor)
+            self.errors[item] = int(self.errors[item] * factor)
+            if not self.counts[item]:
+                del self.counts[item]
+                del self.errors[item]
+        self._rebuild()
+
+
+class HotLinkPinner:
+    def __init__(self, link_cache: LinkCache, repository: Repository, capacity: int = 1000, top_k: int = 100,
+                 min_hits: int = 100, interval: float = 1.0, refresh_ahead: float = 10.0, decay_interval: float = 60.0):
+        self.link_cache = link_cache
+        self.repository = repository
+        self.sketch = SpaceSaving(capacity)
+        self.top_k = top_k
+        self.min_hits = min_hits
+        self.interval = interval
+        self.refresh_ahead = refresh_ahead
+        self.decay_interval = decay_interval
+        self._last_decay = time.monotonic()
+        self._task = None
+
+
+    def record(self, short_code: str):
+        self.sketch.add(short_code)
+
+
+    def top(self, k: Optional[int] = None) -> list:
+        pinned = self.link_cache.pinned()
+        return [
+            {"short_code": item, "count": count, "error": error, "pinned": item in pinned}
+            for item, count, error in self.sketch.top(k or self.top_k)
+        ]
+
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.update()
+            except Exception:
+                logging.exception("Не удалось обновить закреплённые популярные ссылки")
+
+
+    async def update(self):
+        if time.monotonic() - self._last_decay >= self.decay_interval:
+            self.sketch.decay()
+            self._last_decay = time.monotonic()
+
+        hot = {item for item, count, error in self.sketch.top(self.top_k) if count - error >= self.min_hits}
+        for short_code in self.link_cache.pinned():
+            if short_code not in hot:
+                self.link_cache.unpin(short_code)
+        for short_code in hot:
+            self.link_cache.pin(short_code)
+        HOT_LINKS_PINNED.set(len(self.link_cache.pinned()))
+
+        deadline = time.monotonic() + self.refresh_ahead
+        stale = [(short_code, entry) for short_code, entry in self.link_cache.pinned().items() if entry[1] <= deadline]
+        await asyncio.gather(*(self._refresh(short_code, entry) for short_code, entry in stale))
+
+
+    async def _refresh(self, short_code: str, entry: tuple):
+        try:
+            link = await self.repository.find_link_by_short_code(short_code)
+        except Exception:
+            HOT_LINK_REFRESHES.labels('error').inc()
+            logging.exception(f"Не удалось обновить закреплённую ссылку {short_code}")
+            return
+
+        full_link, expires_in = (link['full_link'], link['expires_in']) if link is not None else (None, None)
+        if self.link_cache.refresh_pinned(short_code, entry, full_link, expires_in):
+            HOT_LINK_REFRESHES.labels('refreshed').inc()
+        else:
+            HOT_LINK_REFRESHES.labels('discarded').inc()
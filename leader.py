@@ -0,0 +1,95 @@
+import asyncio
+import inspect
+import logging
+
+from typing import Awaitable, Callable, Union
+
+from repository import Repository
+from metrics import SCHEDULER_LEADER
+
+logging.basicConfig(level=logging.INFO)
+
+LEADER_LOCK_ID = 7301004
+
+
+class LeaderElection:
+    def __init__(self, repository: Repository, on_elected: Callable[[], Union[None, Awaitable[None]]],
+                 on_demoted: Callable[[], Union[None, Awaitable[None]]], interval: float = 5, lock_id: int = LEADER_LOCK_ID):
+        self.repository = repository
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.interval = interval
+        self.lock_id = lock_id
+        self.is_leader = False
+        self._conn = None
+        self._task = None
+
+
+    async def start(self):
+        if self._task is None:
+            await self._campaign()
+            self._task = asyncio.create_task(self._run())
+
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._demote()
+        await self._close()
+
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._campaign()
+
+
+    async def _campaign(self):
+        try:
+            if self._conn is None:
+                self._conn = await self.repository.open_connection()
+            if self.is_leader:
+                await self._conn.fetchval("""
+                    SELECT 1
+                """)
+            elif await self.repository.try_session_lock(self._conn, self.lock_id):
+                self.is_leader = True
+                SCHEDULER_LEADER.set(1)
+                logging.info("Процесс выбран ведущим и запускает фоновые задачи")
+                await self._call(self.on_elected)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("Соединение для выбора ведущего процесса потеряно")
+            await self._demote()
+            await self._close()
+
+
+    async def _demote(self):
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        SCHEDULER_LEADER.set(0)
+        logging.info("Процесс перестал быть ведущим, фоновые задачи остановлены")
+        await self._call(self.on_demoted)
+
+
+    async def _close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                await conn.close(timeout=1)
+            except Exception:
+                conn.terminate()
+
+
+    @staticmethod
+    async def _call(callback: Callable[[], Union[None, Awaitable[None]]]):
+        result = callback()
+        if inspect.isawaitable(result):
+            await result
@@ -0,0 +1,102 @@
+import os
+import asyncio
+import logging
+import argparse
+
+from repository import Repository
+from partitions import StatisticsPartitionManager
+
+logging.basicConfig(level=logging.INFO)
+
+
+async def migrate(repo: Repository, args):
+    await repo.create_table()
+
+
+async def rebuild_counters(repo: Repository, args):
+    links_count = await repo.rebuild_link_counters()
+    logging.info(f"Счётчики переходов пересобраны для {links_count} ссылок")
+
+
+async def aggregate_clicks(repo: Repository, args):
+    buckets_count = await repo.aggregate_click_buckets(args.settle_seconds)
+    logging.info(f"Обновлено корзин статистики переходов: {buckets_count}")
+
+
+async def backfill_url_hashes(repo: Repository, args):
+    updated_count = await repo.backfill_full_link_hashes(args.batch_size)
+    logging.info(f"Заполнены хэши канонических URL для {updated_count} ссылок")
+
+
+async def reconcile_user_counters(repo: Repository, args):
+    users_count = await repo.reconcile_user_counters()
+    logging.info(f"Исправлены счётчики ссылок для {users_count} пользователей")
+
+
+async def maintain_partitions(repo: Repository, args):
+    manager = StatisticsPartitionManager(repo, args.days_ahead, args.retention_days, args.archive_dir)
+    if await manager.run() is None:
+        logging.info("Партиции статистики сейчас обслуживает другой экземпляр")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Служебные команды сервиса коротких ссылок")
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    migrate_parser = commands.add_parser(
+        'migrate',
+        help="Применить недостающие миграции схемы БД"
+    )
+    migrate_parser.set_defaults(handler=migrate)
+
+    rebuild_counters_parser = commands.add_parser(
+        'rebuild-counters',
+        help="Пересобрать link_counters из сырой таблицы statistics. Если старые партиции уже удалены, "
+             "пересобираются только ссылки, созданные после начала оставшейся статистики"
+    )
+    rebuild_counters_parser.set_defaults(handler=rebuild_counters)
+
+    aggregate_clicks_parser = commands.add_parser(
+        'aggregate-clicks',
+        help="Свернуть новые записи statistics в почасовые/посуточные корзины click_buckets"
+    )
+    aggregate_clicks_parser.add_argument('--settle-seconds', type=float, default=0)
+    aggregate_clicks_parser.set_defaults(handler=aggregate_clicks)
+
+    backfill_url_hashes_parser = commands.add_parser(
+        'backfill-url-hashes',
+        help="Заполнить links.full_link_hash для ссылок, созданных до миграции 3"
+    )
+    backfill_url_hashes_parser.add_argument('--batch-size', type=int, default=10000)
+    backfill_url_hashes_parser.set_defaults(handler=backfill_url_hashes)
+
+    reconcile_user_counters_parser = commands.add_parser(
+        'reconcile-user-counters',
+        help="Сверить user_link_counters с таблицами links, expired_links и link_counters"
+    )
+    reconcile_user_counters_parser.set_defaults(handler=reconcile_user_counters)
+
+    maintain_partitions_parser = commands.add_parser(
+        'maintain-partitions',
+        help="Создать будущие партиции statistics и удалить партиции старше срока хранения"
+    )
+    maintain_partitions_parser.add_argument('--days-ahead', type=int, default=int(os.environ.get('STATISTICS_PARTITIONS_DAYS_AHEAD', 7)))
+    maintain_partitions_parser.add_argument('--retention-days', type=float, default=float(os.environ.get('STATISTICS_RETENTION_DAYS', 0)))
+    maintain_partitions_parser.add_argument('--archive-dir', default=os.environ.get('STATISTICS_ARCHIVE_DIR') or None)
+    maintain_partitions_parser.set_defaults(handler=maintain_partitions)
+
+    return parser
+
+
+async def run(args):
+    repo = Repository(args.database_url)
+    await repo.connect()
+    try:
+        await args.handler(repo, args)
+    finally:
+        await repo.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(build_parser().parse_args()))
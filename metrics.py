@@ -0,0 +1,125 @@
+import os
+import time
+import functools
+
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route',
+    ['method', 'route', 'status'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5),
+)
+REPOSITORY_LATENCY = Histogram(
+    'repository_query_duration_seconds', 'Repository method latency',
+    ['method'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5),
+)
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups by cache and result', ['cache', 'result'])
+
+POOL_CONNECTIONS = Gauge('db_pool_connections', 'asyncpg pool connections by pool and state', ['pool', 'state'],
+                         multiprocess_mode='livesum')
+POOL_ACQUIRE_WAIT = Histogram(
+    'db_pool_acquire_wait_seconds', 'Time spent waiting for an asyncpg pool connection',
+    buckets=(.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5),
+)
+REPLICA_HEALTHY = Gauge('db_replica_healthy', 'Whether a read replica is used for reads', ['replica'], multiprocess_mode='livemin')
+REPLICA_LAG = Gauge('db_replica_lag_seconds', 'Replication lag of a read replica', ['replica'], multiprocess_mode='livemax')
+POOL_EXHAUSTED = Counter('db_pool_exhausted_total', 'Requests rejected because no pool connection was available', ['reason'])
+
+CLICK_QUEUE_DEPTH = Gauge('click_queue_depth', 'Click events waiting to be written', multiprocess_mode='livesum')
+CLICKS_DROPPED = Counter('clicks_dropped_total', 'Click events dropped because the queue was full')
+CLICKS_FAILED = Counter('clicks_failed_total', 'Click events lost because a batch write failed')
+CLICKS_WRITTEN = Counter('clicks_written_total', 'Click events written to statistics')
+
+LINK_FILTER_READY = Gauge('link_filter_ready', 'Whether the short code Bloom filter is loaded and used', multiprocess_mode='livemin')
+LINK_FILTER_ITEMS = Gauge('link_filter_items', 'Short codes added to the Bloom filter since it was built', multiprocess_mode='livemax')
+LINK_FILTER_REJECTED = Counter('link_filter_rejected_total', 'Redirect lookups rejected by the Bloom filter')
+
+RATE_LIMIT_DECISIONS = Counter(
+    'rate_limit_decisions_total', 'Rate limiter decisions by rule, scope, decision and where it was made',
+    ['rule', 'scope', 'decision', 'source'],
+)
+HOT_LINKS_PINNED = Gauge('hot_links_pinned', 'Heavy-hitter links pinned in the in-process link cache', multiprocess_mode='livesum')
+HOT_LINK_REFRESHES = Counter('hot_link_refreshes_total', 'Background refreshes of pinned links by outcome', ['outcome'])
+LINK_CACHE_WARMED = Gauge('link_cache_warmed_links', 'Links loaded into the in-process link cache at startup', multiprocess_mode='livesum')
+SCHEDULER_LEADER = Gauge('scheduler_leader', 'Whether a worker holds the leader lock and runs background jobs', multiprocess_mode='livemax')
+
+SWEEPER_RUNS = Counter('expiry_sweeper_runs_total', 'Expiry sweeper runs by outcome', ['outcome'])
+SWEEPER_ROWS_MOVED = Counter('expiry_sweeper_rows_moved_total', 'Expired links moved to expired_links')
+SWEEPER_RUN_DURATION = Histogram('expiry_sweeper_run_duration_seconds', 'Expiry sweeper run duration')
+SWEEPER_LAG = Gauge('expiry_sweeper_lag_seconds', 'Age of the oldest expired link still in links after a run', multiprocess_mode='livemax')
+SWEEPER_BATCH_SIZE = Gauge('expiry_sweeper_batch_size', 'Current adaptive batch size of the expiry sweeper', multiprocess_mode='livemax')
+
+STATISTICS_PARTITION_RUNS = Counter('statistics_partition_runs_total', 'Statistics partition maintenance runs by outcome', ['outcome'])
+STATISTICS_PARTITIONS = Gauge('statistics_partitions', 'Range partitions of the statistics table after the last maintenance run',
+                              multiprocess_mode='livemax')
+STATISTICS_PARTITIONS_CREATED = Counter('statistics_partitions_created_total', 'Statistics partitions created ahead of time')
+STATISTICS_PARTITIONS_DROPPED = Counter('statistics_partitions_dropped_total', 'Statistics partitions dropped after the retention period')
+
+LINK_CACHE_HIT = CACHE_REQUESTS.labels('link', 'hit')
+LINK_CACHE_NEGATIVE_HIT = CACHE_REQUESTS.labels('link', 'negative_hit')
+LINK_CACHE_MISS = CACHE_REQUESTS.labels('link', 'miss')
+SHARED_LINK_CACHE_HIT = CACHE_REQUESTS.labels('link_shared', 'hit')
+SHARED_LINK_CACHE_MISS = CACHE_REQUESTS.labels('link_shared', 'miss')
+CREDENTIAL_CACHE_HIT = CACHE_REQUESTS.labels('credential', 'hit')
+CREDENTIAL_CACHE_MISS = CACHE_REQUESTS.labels('credential', 'miss')
+RESPONSE_CACHE_HIT = CACHE_REQUESTS.labels('response', 'hit')
+RESPONSE_CACHE_MISS = CACHE_REQUESTS.labels('response', 'miss')
+
+
+def timed(method):
+    histogram = REPOSITORY_LATENCY.labels(method.__name__)
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+def observe_pool(pool, name: str):
+    size, idle = pool.get_size(), pool.get_idle_size()
+    POOL_CONNECTIONS.labels(name, 'total').set(size)
+    POOL_CONNECTIONS.labels(name, 'idle').set(idle)
+    POOL_CONNECTIONS.labels(name, 'in_use').set(size - idle)
+    POOL_CONNECTIONS.labels(name, 'max').set(pool.get_max_size())
+
+
+def render():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            REQUEST_LATENCY.labels(
+                scope['method'], route.path if route is not None else 'unmatched', status
+            ).observe(time.perf_counter() - started)
@@ -0,0 +1,264 @@
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+MIGRATIONS_LOCK_ID = 7301001
+
+MIGRATIONS = [
+    (1, 'initial_schema', [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            token TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS links (
+            id SERIAL PRIMARY KEY,
+            full_link VARCHAR(255) NOT NULL,
+            short_link VARCHAR(255) NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP,
+            user_id INTEGER,
+            is_authorized BOOLEAN DEFAULT FALSE
+        );
+        """,
+        """
+        CREATE SEQUENCE IF NOT EXISTS short_code_seq INCREMENT BY 1000 MINVALUE 0 START WITH 0;
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS statistics (
+            id SERIAL PRIMARY KEY,
+            short_link VARCHAR(255) NOT NULL,
+            access_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS link_counters (
+            short_link VARCHAR(255) PRIMARY KEY,
+            transitions_count BIGINT NOT NULL DEFAULT 0,
+            last_use_date TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS click_buckets (
+            short_link VARCHAR(255) NOT NULL,
+            granularity VARCHAR(8) NOT NULL,
+            bucket_start TIMESTAMP NOT NULL,
+            clicks BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (short_link, granularity, bucket_start)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS aggregation_watermarks (
+            name VARCHAR(64) PRIMARY KEY,
+            watermark TIMESTAMP NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS expired_links (
+            id SERIAL PRIMARY KEY,
+            full_link VARCHAR(255) NOT NULL,
+            short_link VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP,
+            expires_at TIMESTAMP,
+            deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            user_id INTEGER,
+            is_authorized BOOLEAN DEFAULT FALSE
+        );
+        """,
+        """
+        INSERT INTO users (id, token)
+        VALUES (1, 'token1'), (2, 'token2')
+        ON CONFLICT (id) DO NOTHING;
+        """,
+        """
+        INSERT INTO aggregation_watermarks (name, watermark)
+        VALUES ('click_buckets', '1970-01-01')
+        ON CONFLICT (name) DO NOTHING;
+        """,
+    ]),
+    (2, 'lookup_indexes', [
+        """
+        CREATE INDEX IF NOT EXISTS links_full_link_idx ON links USING hash (full_link);
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS links_expires_at_idx ON links (expires_at) WHERE expires_at IS NOT NULL;
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS links_user_id_idx ON links (user_id);
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS statistics_short_link_access_date_idx ON statistics (short_link, access_date);
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS expired_links_user_id_idx ON expired_links (user_id);
+        """,
+    ]),
+    (3, 'full_link_hash', [
+        """
+        ALTER TABLE links ADD COLUMN IF NOT EXISTS full_link_hash BIGINT;
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS links_full_link_hash_user_id_idx ON links (full_link_hash, user_id);
+        """,
+        """
+        DROP INDEX IF EXISTS links_full_link_idx;
+        """,
+    ]),
+    (4, 'user_link_counters', [
+        """
+        CREATE TABLE IF NOT EXISTS user_link_counters (
+            user_id INTEGER PRIMARY KEY,
+            active_links BIGINT NOT NULL DEFAULT 0,
+            expired_links BIGINT NOT NULL DEFAULT 0,
+            transitions_count BIGINT NOT NULL DEFAULT 0
+        );
+        """,
+        """
+        INSERT INTO user_link_counters (user_id, active_links, expired_links, transitions_count)
+        SELECT user_id, SUM(active)::bigint AS active_links, SUM(expired)::bigint AS expired_links,
+               SUM(clicks)::bigint AS transitions_count
+        FROM (
+            SELECT l.user_id, 1 AS active, 0 AS expired, COALESCE(c.transitions_count, 0) AS clicks
+            FROM links l LEFT JOIN link_counters c ON c.short_link = l.short_link
+            WHERE l.user_id IS NOT NULL
+            UNION ALL
+            SELECT e.user_id, 0, 1, COALESCE(c.transitions_count, 0)
+            FROM expired_links e LEFT JOIN link_counters c ON c.short_link = e.short_link
+            WHERE e.user_id IS NOT NULL
+        ) user_links
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO NOTHING;
+        """,
+    ]),
+    (5, 'partitioned_statistics', [
+        """
+        ALTER TABLE statistics RENAME TO statistics_legacy;
+        """,
+        """
+        ALTER INDEX statistics_short_link_access_date_idx RENAME TO statistics_legacy_short_link_access_date_idx;
+        """,
+        """
+        DELETE FROM statistics_legacy WHERE access_date IS NULL;
+        """,
+        """
+        ALTER TABLE statistics_legacy DROP COLUMN id, ALTER COLUMN access_date SET NOT NULL;
+        """,
+        """
+        CREATE TABLE statistics (
+            short_link VARCHAR(255) NOT NULL,
+            access_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) PARTITION BY RANGE (access_date);
+        """,
+        """
+        CREATE INDEX statistics_short_link_access_date_idx ON statistics (short_link, access_date);
+        """,
+        """
+        DO $$
+        BEGIN
+            EXECUTE format(
+                'ALTER TABLE statistics ATTACH PARTITION statistics_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+                GREATEST(
+                    date_trunc('day', LOCALTIMESTAMP),
+                    (SELECT date_trunc('day', MAX(access_date)) FROM statistics_legacy)
+                ) + interval '1 day'
+            );
+        END
+        $$;
+        """,
+        """
+        CREATE TABLE statistics_default PARTITION OF statistics DEFAULT;
+        """,
+    ]),
+    (6, 'statistics_visitor_hash', [
+        """
+        ALTER TABLE statistics ADD COLUMN IF NOT EXISTS visitor_hash BIGINT;
+        """,
+    ]),
+    (7, 'links_short_link_unique', [
+        """
+        WITH duplicates AS (
+            DELETE FROM links l
+            USING links kept
+            WHERE kept.short_link = l.short_link AND kept.id < l.id
+            RETURNING l.full_link, l.short_link, l.created_at, l.expires_at, l.user_id, l.is_authorized
+        )
+        INSERT INTO expired_links (full_link, short_link, created_at, expires_at, user_id, is_authorized)
+        SELECT full_link, short_link, created_at, expires_at, user_id, is_authorized FROM duplicates;
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS links_short_link_key ON links (short_link);
+        """,
+    ]),
+    (8, 'expired_links_transitions', [
+        """
+        ALTER TABLE expired_links ADD COLUMN IF NOT EXISTS transitions_count BIGINT NOT NULL DEFAULT 0;
+        """,
+        """
+        UPDATE expired_links e
+        SET transitions_count = c.transitions_count
+        FROM link_counters c
+        WHERE c.short_link = e.short_link
+          AND NOT EXISTS (SELECT 1 FROM links l WHERE l.short_link = e.short_link)
+          AND e.id = (SELECT MAX(x.id) FROM expired_links x WHERE x.short_link = e.short_link);
+        """,
+        """
+        DELETE FROM link_counters c
+        WHERE NOT EXISTS (SELECT 1 FROM links l WHERE l.short_link = c.short_link);
+        """,
+        """
+        INSERT INTO user_link_counters (user_id, active_links, expired_links, transitions_count)
+        SELECT user_id, SUM(active)::bigint, SUM(expired)::bigint, SUM(clicks)::bigint
+        FROM (
+            SELECT l.user_id, 1 AS active, 0 AS expired, COALESCE(c.transitions_count, 0) AS clicks
+            FROM links l LEFT JOIN link_counters c ON c.short_link = l.short_link
+            WHERE l.user_id IS NOT NULL
+            UNION ALL
+            SELECT e.user_id, 0, 1, e.transitions_count
+            FROM expired_links e
+            WHERE e.user_id IS NOT NULL
+        ) user_links
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET
+            active_links = EXCLUDED.active_links,
+            expired_links = EXCLUDED.expired_links,
+            transitions_count = EXCLUDED.transitions_count;
+        """,
+    ]),
+]
+
+
+async def apply_migrations(conn) -> list:
+    async with conn.transaction():
+        await conn.execute("""
+            SELECT pg_advisory_xact_lock($1)
+        """, MIGRATIONS_LOCK_ID)
+
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        applied_versions = {
+            row['version'] for row in await conn.fetch("""
+                SELECT version FROM schema_migrations
+            """)
+        }
+
+        applied = []
+        for version, name, statements in MIGRATIONS:
+            if version in applied_versions:
+                continue
+            logging.info(f"Применяется миграция {version}: {name}")
+            for statement in statements:
+                await conn.execute(statement)
+            await conn.execute("""
+                INSERT INTO schema_migrations (version, name) VALUES ($1, $2)
+            """, version, name)
+            applied.append(version)
+
+        return applied
@@ -0,0 +1,101 @@
+import os
+import gzip
+import time
+import asyncio
+import logging
+
+from typing import Optional
+from datetime import timedelta
+
+from repository import Repository
+from metrics import STATISTICS_PARTITION_RUNS, STATISTICS_PARTITIONS, STATISTICS_PARTITIONS_CREATED, STATISTICS_PARTITIONS_DROPPED
+
+logging.basicConfig(level=logging.INFO)
+
+DAY = timedelta(days=1)
+
+
+class StatisticsPartitionManager:
+    def __init__(self, repository: Repository, days_ahead: int = 7, retention_days: float = 0,
+                 archive_dir: Optional[str] = None, lock_timeout: float = 5):
+        self.repository = repository
+        self.days_ahead = days_ahead
+        self.retention_days = retention_days
+        self.archive_dir = archive_dir
+        self.lock_timeout = lock_timeout
+        self.last_run = None
+
+
+    async def run(self) -> Optional[dict]:
+        async with self.repository.statistics_partitions_lock() as conn:
+            if conn is None:
+                STATISTICS_PARTITION_RUNS.labels('skipped').inc()
+                logging.info("Обслуживание партиций статистики уже выполняется другим экземпляром")
+                return None
+
+            started = time.monotonic()
+            bounds = await self.repository.get_statistics_maintenance_bounds(conn)
+            partitions = await self.repository.get_statistics_partitions(conn)
+
+            created = []
+            days = [bounds['today'] + DAY * i for i in range(self.days_ahead + 1)]
+            for day in sorted(set(days) | set(bounds['default_days'])):
+                if not self._is_covered(partitions, day):
+                    name = await self.repository.create_statistics_partition(conn, day, day + DAY)
+                    partitions.append({"name": name, "start": day, "end": day + DAY, "is_default": False})
+                    created.append(name)
+
+            dropped = []
+            archived = []
+            if self.retention_days:
+                cutoff = min(bounds['today'] - timedelta(days=self.retention_days), bounds['watermark'])
+                for partition in partitions:
+                    if partition['is_default'] or partition['end'] > cutoff:
+                        continue
+                    if self.archive_dir:
+                        archived.append(await self._archive(conn, partition['name']))
+                    await self.repository.drop_statistics_partition(conn, partition['name'], self.lock_timeout)
+                    dropped.append(partition['name'])
+
+        self.last_run = {
+            "created": created,
+            "dropped": dropped,
+            "archived": archived,
+            "partitions": len(partitions) - len(dropped),
+            "duration_seconds": time.monotonic() - started,
+        }
+        STATISTICS_PARTITION_RUNS.labels('completed').inc()
+        STATISTICS_PARTITIONS_CREATED.inc(len(created))
+        STATISTICS_PARTITIONS_DROPPED.inc(len(dropped))
+        STATISTICS_PARTITIONS.set(self.last_run["partitions"])
+        logging.info(f"Обслуживание партиций статистики: {self.last_run}")
+        return self.last_run
+
+
+    @staticmethod
+    def _is_covered(partitions: list, day) -> bool:
+        for partition in partitions:
+            if partition['is_default']:
+                continue
+            if (partition['start'] is None or partition['start'] <= day) and day < partition['end']:
+                return True
+        return False
+
+
+    async def _archive(self, conn, name: str) -> str:
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{name}.csv.gz")
+        partial_path = path + '.partial'
+        archive = gzip.open(partial_path, 'wb')
+        try:
+            async def write(chunk: bytes):
+                await asyncio.to_thread(archive.write, chunk)
+
+            await self.repository.copy_statistics_partition(conn, name, write)
+        except BaseException:
+            archive.close()
+            os.remove(partial_path)
+            raise
+        archive.close()
+        os.replace(partial_path, path)
+        return path
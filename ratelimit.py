@@ -0,0 +1,259 @@
+import math
+import time
+import logging
+
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from metrics import RATE_LIMIT_DECISIONS
+
+logging.basicConfig(level=logging.INFO)
+
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local buckets = {}
+local denied = false
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 3 - 2])
+    local burst = tonumber(ARGV[i * 3 - 1])
+    local requested = tonumber(ARGV[i * 3])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    local granted = math.min(requested, math.floor(tokens))
+    if granted == 0 then
+        denied = true
+    end
+    buckets[i] = {rate, burst, tokens, granted}
+end
+local results = {}
+for i, key in ipairs(KEYS) do
+    local rate, burst, tokens, granted = unpack(buckets[i])
+    local retry_after_ms = 0
+    if granted == 0 then
+        retry_after_ms = math.ceil((1 - tokens) / rate * 1000)
+    end
+    if denied then
+        granted = 0
+    else
+        redis.call('HSET', key, 'tokens', tostring(tokens - granted), 'ts', tostring(now))
+        redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+    end
+    results[i] = {granted, retry_after_ms}
+end
+return results
+"""
+
+TOO_MANY_REQUESTS_BODY = b'{"detail":"Too many requests"}'
+
+
+def client_ip(scope, trusted_proxies: int = 0) -> Optional[str]:
+    if trusted_proxies > 0:
+        forwarded = b','.join(value for name, value in scope['headers'] if name == b'x-forwarded-for')
+        addresses = [address.strip() for address in forwarded.decode('latin-1').split(',') if address.strip()]
+        if addresses:
+            return addresses[-min(trusted_proxies, len(addresses))]
+    client = scope.get('client')
+    return client[0] if client else None
+
+
+class RateLimit:
+    def __init__(self, requests: int, seconds: float):
+        self.burst = requests
+        self.rate = requests / seconds
+
+
+    @classmethod
+    def parse(cls, value: Optional[str]) -> Optional['RateLimit']:
+        if not value:
+            return None
+        requests, seconds = value.split('/')
+        return cls(int(requests), float(seconds))
+
+
+class RateLimitRule:
+    def __init__(self, name: str, method: str, limits: Dict[str, Optional[RateLimit]], paths: Iterable[str] = (),
+                 prefix: Optional[str] = None):
+        self.name = name
+        self.method = method
+        self.limits = {scope: limit for scope, limit in limits.items() if limit is not None}
+        self.paths = set(paths)
+        self.prefix = prefix
+
+
+    def matches(self, method: str, path: str) -> bool:
+        if method != self.method:
+            return False
+        if path in self.paths:
+            return True
+        return (self.prefix is not None and path.startswith(self.prefix) and len(path) > len(self.prefix)
+                and '/' not in path[len(self.prefix):])
+
+
+class RateLimiter:
+    def __init__(self, redis, lease_fraction: float = 0.1, lease_seconds: float = 1.0, error_backoff: float = 1.0,
+                 max_local_keys: int = 100000, prefix: str = 'ratelimit:'):
+        self.script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self.lease_fraction = lease_fraction
+        self.lease_seconds = lease_seconds
+        self.error_backoff = error_backoff
+        self.max_local_keys = max_local_keys
+        self.prefix = prefix
+        self.leases = {}
+        self.blocked = {}
+        self.redis_unavailable_until = 0.0
+
+
+    async def check(self, rule: RateLimitRule, identities: Dict[str, str]) -> float:
+        now = time.monotonic()
+        retry_after = 0.0
+        leased = []
+        misses = []
+        for scope, limit in rule.limits.items():
+            identity = identities.get(scope)
+            if identity is None:
+                continue
+            key = f"{self.prefix}{rule.name}:{scope}:{identity}"
+
+            blocked_until = self.blocked.get(key, 0.0)
+            if blocked_until > now:
+                RATE_LIMIT_DECISIONS.labels(rule.name, scope, 'rejected', 'local').inc()
+                retry_after = max(retry_after, blocked_until - now)
+                continue
+
+            lease = self.leases.get(key)
+            if lease is not None and lease[0] > 0 and lease[1] > now:
+                leased.append((scope, lease))
+                continue
+
+            misses.append((scope, key, limit))
+
+        if retry_after:
+            return retry_after
+
+        for _, lease in leased:
+            lease[0] -= 1
+        if misses:
+            retry_after = await self._acquire(rule, misses, now)
+        if retry_after:
+            for _, lease in leased:
+                lease[0] += 1
+            return retry_after
+
+        for scope, _ in leased:
+            RATE_LIMIT_DECISIONS.labels(rule.name, scope, 'allowed', 'local').inc()
+        return 0.0
+
+
+    async def _acquire(self, rule: RateLimitRule, misses: list, now: float) -> float:
+        if now < self.redis_unavailable_until:
+            for scope, _, _ in misses:
+                RATE_LIMIT_DECISIONS.labels(rule.name, scope, 'allowed', 'error').inc()
+            return 0.0
+
+        args = []
+        for _, _, limit in misses:
+            args += [limit.rate, limit.burst, self._lease_size(limit)]
+        try:
+            results = await self.script(keys=[key for _, key, _ in misses], args=args)
+        except Exception:
+            self.redis_unavailable_until = now + self.error_backoff
+            logging.exception(f"Ограничитель частоты запросов недоступен, запросы пропускаются {self.error_backoff} с")
+            for scope, _, _ in misses:
+                RATE_LIMIT_DECISIONS.labels(rule.name, scope, 'allowed', 'error').inc()
+            return 0.0
+
+        if len(self.leases) + len(self.blocked) > self.max_local_keys:
+            self._prune(now)
+
+        retry_after = 0.0
+        for (scope, key, _), (granted, retry_after_ms) in zip(misses, results):
+            granted, retry_after_ms = int(granted), int(retry_after_ms)
+            if granted > 0:
+                self.leases[key] = [granted - 1, now + self.lease_seconds]
+                RATE_LIMIT_DECISIONS.labels(rule.name, scope, 'allowed', 'redis').inc()
+            elif retry_after_ms > 0:
+                self.leases.pop(key, None)
+                self.blocked[key] = now + retry_after_ms / 1000
+                retry_after = max(retry_after, retry_after_ms / 1000)
+                RATE_LIMIT_DECISIONS.labels(rule.name, scope, 'rejected', 'redis').inc()
+        return retry_after
+
+
+    def _lease_size(self, limit: RateLimit) -> int:
+        return max(1, min(int(limit.burst * self.lease_fraction), math.floor(limit.rate * self.lease_seconds)))
+
+
+    def _prune(self, now: float):
+        self.leases = {key: lease for key, lease in self.leases.items() if lease[0] > 0 and lease[1] > now}
+        self.blocked = {key: until for key, until in self.blocked.items() if until > now}
+        if len(self.leases) + len(self.blocked) > self.max_local_keys:
+            self.leases.clear()
+            self.blocked.clear()
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, limiter: RateLimiter, rules: Iterable[RateLimitRule], trusted_proxies: int = 0,
+                 authenticate: Optional[Callable[[int, str], Awaitable[Optional[dict]]]] = None):
+        self.app = app
+        self.limiter = limiter
+        self.rules = list(rules)
+        self.trusted_proxies = trusted_proxies
+        self.authenticate = authenticate
+
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        rule = next((rule for rule in self.rules if rule.matches(scope['method'], scope['path'])), None)
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = await self.limiter.check(rule, await self._identities(scope, rule))
+        if not retry_after:
+            await self.app(scope, receive, send)
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 429,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(TOO_MANY_REQUESTS_BODY)).encode()),
+                (b'retry-after', str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': TOO_MANY_REQUESTS_BODY})
+
+
+    async def _identities(self, scope, rule: RateLimitRule) -> Dict[str, str]:
+        identities = {'route': rule.name}
+        if 'user' in rule.limits:
+            user_id = await self._authenticated_user(scope)
+            if user_id is not None:
+                identities['user'] = user_id
+
+        ip = client_ip(scope, self.trusted_proxies)
+        if ip:
+            identities['ip'] = ip
+        return identities
+
+
+    async def _authenticated_user(self, scope) -> Optional[str]:
+        if self.authenticate is None:
+            return None
+        headers = dict(scope['headers'])
+        user_id = headers.get(b'x-user-id', b'').decode('latin-1').strip()
+        authorization = headers.get(b'authorization', b'').decode('latin-1').split()
+        if not user_id.isdigit() or len(authorization) != 2:
+            return None
+        try:
+            user = await self.authenticate(int(user_id), authorization[1])
+        except Exception as e:
+            logging.warning(f"Не удалось проверить токен пользователя {user_id} для ограничителя частоты: {e}")
+            return None
+        return user_id if user else None
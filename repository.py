@@ -1,116 +1,348 @@
+import re
+import time
+import asyncio
 import asyncpg
 import logging
 
+from typing import Optional
+from datetime import datetime
+from contextlib import asynccontextmanager
+
 from fastapi.encoders import jsonable_encoder
+from migrations import apply_migrations
+from urls import url_hash
+from metrics import timed, observe_pool, POOL_ACQUIRE_WAIT, POOL_EXHAUSTED, REPLICA_HEALTHY, REPLICA_LAG
 
 logging.basicConfig(level=logging.INFO)
 
+CLICK_GRANULARITIES = ('minute', 'hour', 'day')
+EXPIRY_SWEEP_LOCK_ID = 7301002
+STATISTICS_PARTITIONS_LOCK_ID = 7301003
+PARTITION_BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+MAX_RECENT_WRITES = 100000
+
+USER_LINK_COUNTS = """
+    SELECT user_id, SUM(active)::bigint AS active_links, SUM(expired)::bigint AS expired_links,
+           SUM(clicks)::bigint AS transitions_count
+    FROM (
+        SELECT l.user_id, 1 AS active, 0 AS expired, COALESCE(c.transitions_count, 0) AS clicks
+        FROM links l LEFT JOIN link_counters c ON c.short_link = l.short_link
+        WHERE l.user_id {users}
+        UNION ALL
+        SELECT e.user_id, 0, 1, e.transitions_count
+        FROM expired_links e
+        WHERE e.user_id {users}
+    ) user_links
+    GROUP BY user_id
+"""
+
+PREPARED_STATEMENTS = {
+    'find_user_by_token_and_id': """
+        SELECT * FROM users WHERE id = $1 AND token = $2
+    """,
+    'find_link_by_short_code': """
+        SELECT full_link, EXTRACT(EPOCH FROM expires_at - CURRENT_TIMESTAMP)::float8 AS expires_in
+        FROM links
+        WHERE short_link = $1 AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+    """,
+    'insert_click': """
+        INSERT INTO statistics (short_link, access_date, visitor_hash)
+        VALUES ($1, timezone('UTC', now()), $2)
+        RETURNING access_date
+    """,
+    'increment_link_counters': """
+        INSERT INTO link_counters (short_link, transitions_count, last_use_date)
+        SELECT c.short_link, c.transitions_count, c.last_use_date
+        FROM unnest($1::varchar[], $2::bigint[], $3::timestamp[]) AS c(short_link, transitions_count, last_use_date)
+        WHERE EXISTS (SELECT 1 FROM links l WHERE l.short_link = c.short_link)
+        ON CONFLICT (short_link) DO UPDATE SET
+            transitions_count = link_counters.transitions_count + EXCLUDED.transitions_count,
+            last_use_date = GREATEST(link_counters.last_use_date, EXCLUDED.last_use_date)
+    """,
+    'increment_user_transitions': """
+        INSERT INTO user_link_counters (user_id, transitions_count)
+        SELECT l.user_id, SUM(c.transitions_count)
+        FROM unnest($1::varchar[], $2::bigint[]) AS c(short_link, transitions_count)
+        JOIN links l ON l.short_link = c.short_link
+        WHERE l.user_id IS NOT NULL
+        GROUP BY l.user_id
+        ORDER BY l.user_id
+        ON CONFLICT (user_id) DO UPDATE SET
+            transitions_count = user_link_counters.transitions_count + EXCLUDED.transitions_count
+    """,
+    'adjust_user_counters': """
+        INSERT INTO user_link_counters (user_id, active_links, expired_links, transitions_count)
+        SELECT * FROM unnest($1::integer[], $2::bigint[], $3::bigint[], $4::bigint[])
+        ON CONFLICT (user_id) DO UPDATE SET
+            active_links = user_link_counters.active_links + EXCLUDED.active_links,
+            expired_links = user_link_counters.expired_links + EXCLUDED.expired_links,
+            transitions_count = user_link_counters.transitions_count + EXCLUDED.transitions_count
+    """,
+}
+
+
+class PoolExhaustedError(Exception):
+    pass
+
+
+class StatementConnection(asyncpg.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = {}
+
+
+class Replica:
+    def __init__(self, name: str, db_url: str):
+        self.name = name
+        self.db_url = db_url
+        self.pool = None
+        self.healthy = False
+        self.lag_seconds = None
+        self.waiting = 0
+
+
+    def in_use(self) -> int:
+        return self.pool.get_size() - self.pool.get_idle_size() + self.waiting
+
+
 class Repository:
     _instance = None
 
-    def __new__(cls, db_url: str):
+    def __new__(cls, db_url: str, min_size: int = 10, max_size: int = 10, max_queries: int = 50000,
+                max_inactive_connection_lifetime: float = 300.0, statement_cache_size: int = 100,
+                acquire_timeout: Optional[float] = None, max_waiting: Optional[int] = None,
+                replica_urls: Optional[list] = None, max_replica_lag: float = 5.0,
+                read_your_writes_seconds: float = 5.0):
         if cls._instance is None:
             cls._instance = super(Repository, cls).__new__(cls)
             cls._instance.db_url = db_url
             cls._instance.pool = None
+            cls._instance.replicas = [
+                Replica(f"replica{index}", replica_url) for index, replica_url in enumerate(replica_urls or [])
+            ]
+            cls._instance.max_replica_lag = max_replica_lag
+            cls._instance.read_your_writes_seconds = read_your_writes_seconds
+            cls._instance.recent_writes = {}
+            cls._instance.next_replica = 0
+            cls._instance.pool_options = {
+                'min_size': min_size,
+                'max_size': max_size,
+                'max_queries': max_queries,
+                'max_inactive_connection_lifetime': max_inactive_connection_lifetime,
+                'statement_cache_size': statement_cache_size,
+            }
+            cls._instance.acquire_timeout = acquire_timeout
+            cls._instance.max_waiting = max_waiting
+            cls._instance.waiting = 0
         return cls._instance
 
 
     async def connect(self):
-        self.pool = await asyncpg.create_pool(self.db_url)
+        self.pool = await asyncpg.create_pool(self.db_url, connection_class=StatementConnection, **self.pool_options)
+        observe_pool(self.pool, 'primary')
+        await self.check_replicas()
+
+
+    async def _connect_replica(self, replica: Replica):
+        replica.pool = await asyncpg.create_pool(replica.db_url, connection_class=StatementConnection, **self.pool_options)
+        observe_pool(replica.pool, replica.name)
+
+
+    async def check_replicas(self):
+        for replica in self.replicas:
+            try:
+                if replica.pool is None:
+                    await self._connect_replica(replica)
+                async with replica.pool.acquire(timeout=self.acquire_timeout) as conn:
+                    replica.lag_seconds = await conn.fetchval("""
+                        SELECT CASE
+                            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                        END::float8
+                    """)
+                healthy = replica.lag_seconds <= self.max_replica_lag
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                logging.warning(f"Реплика {replica.name} недоступна: {e}")
+                replica.lag_seconds = None
+                healthy = False
+
+            if healthy != replica.healthy:
+                logging.info(f"Реплика {replica.name} {'доступна' if healthy else 'исключена из чтения'}, отставание: {replica.lag_seconds}")
+            replica.healthy = healthy
+            REPLICA_HEALTHY.labels(replica.name).set(1 if healthy else 0)
+            if replica.lag_seconds is not None:
+                REPLICA_LAG.labels(replica.name).set(replica.lag_seconds)
+
+
+    def _mark_written(self, *keys):
+        if not self.replicas:
+            return
+        now = time.monotonic()
+        if len(self.recent_writes) >= MAX_RECENT_WRITES:
+            self.recent_writes = {key: deadline for key, deadline in self.recent_writes.items() if deadline > now}
+        for key in keys:
+            self.recent_writes[key] = now + self.read_your_writes_seconds
+
+
+    def _is_sticky(self, keys) -> bool:
+        now = time.monotonic()
+        sticky = False
+        for key in keys:
+            deadline = self.recent_writes.get(key)
+            if deadline is None:
+                continue
+            if deadline > now:
+                sticky = True
+            else:
+                del self.recent_writes[key]
+        return sticky
+
+
+    def _choose_replica(self, sticky: tuple) -> Optional[Replica]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy or self._is_sticky(sticky):
+            return None
+        self.next_replica = (self.next_replica + 1) % len(healthy)
+        candidates = healthy[self.next_replica:] + healthy[:self.next_replica]
+        return min(candidates, key=lambda replica: replica.in_use())
+
+
+    @asynccontextmanager
+    async def _acquire(self, background: bool = False, read: bool = False, sticky: tuple = ()):
+        replica = self._choose_replica(sticky) if read else None
+        if replica is not None:
+            if self.max_waiting is not None and replica.waiting >= self.max_waiting:
+                POOL_EXHAUSTED.labels('queue_full').inc()
+                raise PoolExhaustedError(f"Превышена очередь ожидания соединения с репликой {replica.name}: {replica.waiting}")
+
+            started = time.perf_counter()
+            replica.waiting += 1
+            try:
+                conn = await replica.pool.acquire(timeout=self.acquire_timeout)
+            except asyncio.TimeoutError:
+                POOL_EXHAUSTED.labels('timeout').inc()
+                raise PoolExhaustedError(f"Нет свободного соединения с репликой {replica.name} за {self.acquire_timeout} с") from None
+            except (OSError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError) as e:
+                logging.warning(f"Реплика {replica.name} исключена из чтения: {e}")
+                replica.healthy = False
+                REPLICA_HEALTHY.labels(replica.name).set(0)
+                conn = None
+            finally:
+                replica.waiting -= 1
+
+            if conn is not None:
+                POOL_ACQUIRE_WAIT.observe(time.perf_counter() - started)
+                try:
+                    yield conn
+                finally:
+                    await replica.pool.release(conn)
+                return
+
+        if not background and self.max_waiting is not None and self.waiting >= self.max_waiting:
+            POOL_EXHAUSTED.labels('queue_full').inc()
+            raise PoolExhaustedError(f"Превышена очередь ожидания соединения с БД: {self.waiting}")
+
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            conn = await self.pool.acquire(timeout=None if background else self.acquire_timeout)
+        except asyncio.TimeoutError:
+            POOL_EXHAUSTED.labels('timeout').inc()
+            raise PoolExhaustedError(f"Нет свободного соединения с БД за {self.acquire_timeout} с") from None
+        finally:
+            self.waiting -= 1
+        POOL_ACQUIRE_WAIT.observe(time.perf_counter() - started)
+
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+
+
+    async def _prepared(self, conn, name: str):
+        statement = conn.statements.get(name)
+        if statement is None:
+            statement = await conn.prepare(PREPARED_STATEMENTS[name], name=name)
+            conn.statements[name] = statement
+        return statement
 
 
     async def create_table(self):
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
-                DROP TABLE IF EXISTS links;
-            """)
-
-
-            await conn.execute("""
-                DROP TABLE IF EXISTS users;
-            """)
-
-            await conn.execute("""
-                DROP TABLE IF EXISTS expired_links;
-            """)
-
-            await conn.execute("""
-                DROP TABLE IF EXISTS statistics;
-            """)
-
-
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    token TEXT NOT NULL
-                );
-            """)
-
-
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS links (
-                    id SERIAL PRIMARY KEY,
-                    full_link VARCHAR(255) NOT NULL,
-                    short_link VARCHAR(255) NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    expires_at TIMESTAMP,
-                    user_id INTEGER,
-                    is_authorized BOOLEAN DEFAULT FALSE
-                );
-            """)
-
-
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS statistics (
-                    id SERIAL PRIMARY KEY,
-                    short_link VARCHAR(255) NOT NULL,
-                    access_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
+        async with self._acquire() as conn:
+            await apply_migrations(conn)
 
 
+    async def truncate_tables(self):
+        async with self._acquire() as conn:
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS expired_links (
-                    id SERIAL PRIMARY KEY,
-                    full_link VARCHAR(255) NOT NULL,
-                    short_link VARCHAR(255) NOT NULL,
-                    created_at TIMESTAMP,
-                    expires_at TIMESTAMP,
-                    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    user_id INTEGER,
-                    is_authorized BOOLEAN DEFAULT FALSE
-                );
+                TRUNCATE links, statistics, expired_links, link_counters, click_buckets, user_link_counters RESTART IDENTITY;
             """)
-
-
             await conn.execute("""
-                INSERT INTO users (id, token)
-                VALUES (1, 'token1'), (2, 'token2');
+                UPDATE aggregation_watermarks SET watermark = '1970-01-01';
             """)
 
 
+    @timed
     async def find_user_by_token_and_id(self, user_id: int, token: str):
-        async with self.pool.acquire() as conn:
-            result = await conn.fetchrow("""
-                SELECT * FROM users WHERE id = $1 AND token = $2
-            """, user_id, token)
+        async with self._acquire() as conn:
+            statement = await self._prepared(conn, 'find_user_by_token_and_id')
+            result = await statement.fetchrow(user_id, token)
             if result:
                 return dict(result)
             else:
                 return None
 
 
-    async def save_link_with_user(self, full_link: str, short_link: str, user_id: int, is_authorized: bool, expires_at):
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO links (full_link, short_link, user_id, is_authorized, expires_at)
-                VALUES ($1, $2, $3, $4, $5)
-            """, full_link, short_link, user_id, is_authorized, expires_at)
+    @timed
+    async def save_link_with_user(self, full_link: str, short_link: str, user_id: int, is_authorized: bool, expires_at) -> bool:
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                result = await conn.fetchval("""
+                    INSERT INTO links (full_link, short_link, user_id, is_authorized, expires_at, full_link_hash)
+                    VALUES ($1, $2, $3, $4, $5, $6)
+                    ON CONFLICT (short_link) DO NOTHING
+                    RETURNING id
+                """, full_link, short_link, user_id, is_authorized, expires_at, url_hash(full_link))
+                if result is not None and user_id is not None:
+                    await self._adjust_user_counters(conn, {user_id: (1, 0, 0)})
+            self._mark_written(('user', user_id), ('link', short_link))
+            return result is not None
+
+
+    @timed
+    async def save_links_batch(self, links: list) -> set:
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                result = await conn.fetch("""
+                    INSERT INTO links (full_link, short_link, user_id, is_authorized, expires_at, full_link_hash)
+                    SELECT * FROM unnest($1::varchar[], $2::varchar[], $3::integer[], $4::boolean[], $5::timestamp[], $6::bigint[])
+                    ON CONFLICT (short_link) DO NOTHING
+                    RETURNING short_link
+                """, *(list(column) for column in zip(*links)), [url_hash(link[0]) for link in links])
+                created = {row['short_link'] for row in result}
+                created_by_user = {}
+                for _, short_link, user_id, _, _ in links:
+                    if short_link in created and user_id is not None:
+                        created_by_user[user_id] = (created_by_user.get(user_id, (0, 0, 0))[0] + 1, 0, 0)
+                await self._adjust_user_counters(conn, created_by_user)
+                self._mark_written(*{('user', link[2]) for link in links}, *(('link', short_link) for short_link in created))
+                return created
+
+
+    @timed
+    async def reserve_code_block(self):
+        async with self._acquire() as conn:
+            result = await conn.fetchrow("""
+                SELECT nextval('short_code_seq') AS block_start, seqincrement AS block_size
+                FROM pg_sequence
+                WHERE seqrelid = 'short_code_seq'::regclass
+            """)
+            return result['block_start'], result['block_size']
 
 
+    @timed
     async def find_original_url_by_short_code(self, short_url: str):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             result = await conn.fetchrow("""
                 SELECT full_link FROM links WHERE short_link = $1
             """, short_url)
@@ -118,9 +350,25 @@ class Repository:
                 return result['full_link']
             else:
                 return None
+
+
+    @timed
+    async def find_link_by_short_code(self, short_url: str):
+        async with self._acquire(read=True, sticky=(('link', short_url),)) as conn:
+            statement = await self._prepared(conn, 'find_link_by_short_code')
+            result = await statement.fetchrow(short_url)
+        if result is None and self.replicas:
+            async with self._acquire() as conn:
+                statement = await self._prepared(conn, 'find_link_by_short_code')
+                result = await statement.fetchrow(short_url)
+        if result:
+            return dict(result)
+        else:
+            return None
             
+    @timed
     async def get_link_author(self, short_url: str):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             result = await conn.fetchrow("""
                 SELECT user_id FROM links WHERE short_link = $1
             """, short_url)
@@ -129,22 +377,87 @@ class Repository:
             else:
                 return None
     
+    @timed
     async def delete_link(self, short_url: str):
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
-                DELETE FROM links WHERE short_link = $1
-            """, short_url)
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                user_id = await conn.fetchval("""
+                    DELETE FROM links WHERE short_link = $1
+                    RETURNING user_id
+                """, short_url)
+                if user_id is not None:
+                    await self._remove_link_from_user_counters(conn, short_url, user_id)
+            self._mark_written(('link', short_url))
 
     
+    @timed
     async def update_long_link(self, short_link: str, long_link: str):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
-                UPDATE links SET full_link = $1 WHERE short_link = $2
-            """, long_link, short_link)
+                UPDATE links SET full_link = $1, full_link_hash = $3 WHERE short_link = $2
+            """, long_link, short_link, url_hash(long_link))
+            self._mark_written(('link', short_link))
 
     
+    @timed
+    async def delete_link_by_owner(self, short_url: str, user_id: int) -> bool:
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                result = await conn.fetchval("""
+                    DELETE FROM links WHERE short_link = $1 AND user_id = $2
+                    RETURNING id
+                """, short_url, user_id)
+                if result is not None:
+                    await self._remove_link_from_user_counters(conn, short_url, user_id)
+            self._mark_written(('user', user_id), ('link', short_url))
+            return result is not None
+
+
+    async def _remove_link_from_user_counters(self, conn, short_url: str, user_id: int):
+        transitions_count = await conn.fetchval("""
+            DELETE FROM link_counters WHERE short_link = $1
+            RETURNING transitions_count
+        """, short_url)
+        await self._adjust_user_counters(conn, {user_id: (-1, 0, -(transitions_count or 0))})
+
+
+    async def _adjust_user_counters(self, conn, changes: dict):
+        if not changes:
+            return
+        user_ids = sorted(changes)
+        statement = await self._prepared(conn, 'adjust_user_counters')
+        await statement.fetch(
+            user_ids,
+            [changes[user_id][0] for user_id in user_ids],
+            [changes[user_id][1] for user_id in user_ids],
+            [changes[user_id][2] for user_id in user_ids],
+        )
+
+
+    @timed
+    async def update_long_link_by_owner(self, short_link: str, long_link: str, user_id: int) -> bool:
+        async with self._acquire() as conn:
+            result = await conn.fetchval("""
+                UPDATE links SET full_link = $1, full_link_hash = $4 WHERE short_link = $2 AND user_id = $3
+                RETURNING id
+            """, long_link, short_link, user_id, url_hash(long_link))
+            self._mark_written(('user', user_id), ('link', short_link))
+            return result is not None
+
+
+    @timed
+    async def update_user_token(self, user_id: int, token: str) -> bool:
+        async with self._acquire() as conn:
+            result = await conn.fetchval("""
+                UPDATE users SET token = $1 WHERE id = $2
+                RETURNING id
+            """, token, user_id)
+            return result is not None
+
+
+    @timed
     async def get_creation_date_by_short_link(self, short_link: str):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             result = await conn.fetchrow("""
                 SELECT created_at FROM links WHERE short_link = $1
             """, short_link)
@@ -155,115 +468,530 @@ class Repository:
                 return None
             
 
-    async def save_access_statistics(self, short_url: str):
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO statistics (short_link)
-                VALUES ($1)
-            """, short_url)
+    @timed
+    async def save_access_statistics(self, short_url: str, visitor_hash: Optional[int] = None):
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                statement = await self._prepared(conn, 'insert_click')
+                access_date = await statement.fetchval(short_url, visitor_hash)
+                await self._increment_link_counters(conn, {short_url: (1, access_date)})
 
 
-    async def get_link_stats(self, short_url: str):
-        async with self.pool.acquire() as conn:
-            link_info_result = await conn.fetchrow("""
-                SELECT full_link, created_at FROM links WHERE short_link = $1
-            """, short_url)
+    @timed
+    async def save_access_statistics_batch(self, records):
+        records = [(record[0], record[1], record[2] if len(record) > 2 else None) for record in records]
+        counters = {}
+        for short_link, access_date, _ in records:
+            count, last_use_date = counters.get(short_link, (0, access_date))
+            counters[short_link] = (count + 1, max(last_use_date, access_date))
+
+        async with self._acquire(background=True) as conn:
+            async with conn.transaction():
+                await conn.copy_records_to_table(
+                    'statistics',
+                    records=records,
+                    columns=['short_link', 'access_date', 'visitor_hash']
+                )
+                await self._increment_link_counters(conn, counters)
+                await self._bucket_late_clicks(conn, records)
+
+
+    async def _bucket_late_clicks(self, conn, records):
+        watermark = await conn.fetchval("""
+            SELECT watermark FROM aggregation_watermarks WHERE name = 'click_buckets' FOR SHARE
+        """)
+        late = [record for record in records if record[1] < watermark]
+        if not late:
+            return
+        for granularity in CLICK_GRANULARITIES:
+            await conn.execute("""
+                INSERT INTO click_buckets (short_link, granularity, bucket_start, clicks)
+                SELECT short_link, $1::text, date_trunc($1::text, access_date), COUNT(*)
+                FROM unnest($2::varchar[], $3::timestamp[]) AS c(short_link, access_date)
+                GROUP BY 1, 2, 3
+                ON CONFLICT (short_link, granularity, bucket_start) DO UPDATE
+                SET clicks = click_buckets.clicks + EXCLUDED.clicks
+            """, granularity, [record[0] for record in late], [record[1] for record in late])
+
+
+    async def _increment_link_counters(self, conn, counters: dict):
+        short_links = sorted(counters)
+        transitions = [counters[short_link][0] for short_link in short_links]
+        statement = await self._prepared(conn, 'increment_link_counters')
+        await statement.fetch(
+            short_links,
+            transitions,
+            [counters[short_link][1] for short_link in short_links],
+        )
+        statement = await self._prepared(conn, 'increment_user_transitions')
+        await statement.fetch(short_links, transitions)
+
+
+    @timed
+    async def rebuild_link_counters(self) -> int:
+        async with self._acquire(background=True) as conn:
+            async with conn.transaction():
+                ranged = [partition for partition in await self.get_statistics_partitions(conn) if not partition['is_default']]
+                history_start = None
+                if ranged and all(partition['start'] is not None for partition in ranged):
+                    history_start = min(partition['start'] for partition in ranged)
+                    logging.info(f"Статистика до {history_start} удалена, счётчики ссылок, созданных раньше, не пересобираются")
+
+                await conn.execute("""
+                    DELETE FROM link_counters c
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM links l WHERE l.short_link = c.short_link AND l.created_at < $1::timestamp
+                    )
+                """, history_start)
+                result = await conn.execute("""
+                    INSERT INTO link_counters (short_link, transitions_count, last_use_date)
+                    SELECT s.short_link, COUNT(*), MAX(s.access_date)
+                    FROM statistics s
+                    JOIN links l ON l.short_link = s.short_link
+                    WHERE $1::timestamp IS NULL OR l.created_at >= $1::timestamp
+                    GROUP BY s.short_link
+                """, history_start)
+                return int(result.split()[-1])
+
+
+    @timed
+    async def get_link_stats(self, short_url: str, user_id: Optional[int] = None):
+        async with self._acquire(read=True, sticky=(('user', user_id), ('link', short_url))) as conn:
+            result = await conn.fetchrow("""
+                SELECT l.full_link, l.created_at,
+                       COALESCE(c.transitions_count, 0) AS transitions_count, c.last_use_date
+                FROM links l
+                LEFT JOIN link_counters c ON c.short_link = l.short_link
+                WHERE l.short_link = $1 AND ($2::integer IS NULL OR l.user_id = $2)
+            """, short_url, user_id)
             
-            if link_info_result:
-                full_link = link_info_result['full_link']
-                creation_date = link_info_result['created_at']
-            else:
+            if not result:
                 return None
             
-            transitions_count_result = await conn.fetchrow("""
-                SELECT COUNT(*) FROM statistics WHERE short_link = $1
-            """, short_url)
-            
-            if transitions_count_result:
-                transitions_count = transitions_count_result['count']
-            else:
-                transitions_count = 0
-            
-            last_use_date_result = await conn.fetchrow("""
-                SELECT MAX(access_date) FROM statistics WHERE short_link = $1
-            """, short_url)
-            
-            if last_use_date_result and last_use_date_result['max'] is not None:
-                last_use_date = last_use_date_result['max']
-            else:
-                last_use_date = None
-            
             stats = {
                 "short_url": short_url,
-                "full_url": full_link,
-                "creation_date": creation_date,
-                "transitions_count": transitions_count,
-                "last_use_date": last_use_date
+                "full_url": result['full_link'],
+                "creation_date": result['created_at'],
+                "transitions_count": result['transitions_count'],
+                "last_use_date": result['last_use_date']
             }
             
             return jsonable_encoder(stats)
         
 
+    @timed
+    async def aggregate_click_buckets(self, settle_seconds: float = 120) -> int:
+        async with self._acquire(background=True) as conn:
+            async with conn.transaction():
+                watermark = await conn.fetchval("""
+                    SELECT watermark FROM aggregation_watermarks WHERE name = 'click_buckets' FOR UPDATE
+                """)
+                aggregate_until = await conn.fetchval("""
+                    SELECT date_trunc('minute', timezone('UTC', now()) - make_interval(secs => $1))
+                """, settle_seconds)
+                if aggregate_until <= watermark:
+                    return 0
+
+                buckets_count = 0
+                for granularity in CLICK_GRANULARITIES:
+                    result = await conn.execute("""
+                        INSERT INTO click_buckets (short_link, granularity, bucket_start, clicks)
+                        SELECT short_link, $1::text, date_trunc($1::text, access_date), COUNT(*)
+                        FROM statistics
+                        WHERE access_date >= $2 AND access_date < $3
+                        GROUP BY 1, 2, 3
+                        ON CONFLICT (short_link, granularity, bucket_start) DO UPDATE
+                        SET clicks = click_buckets.clicks + EXCLUDED.clicks
+                    """, granularity, watermark, aggregate_until)
+                    buckets_count += int(result.split()[-1])
+
+                await conn.execute("""
+                    UPDATE aggregation_watermarks SET watermark = $1 WHERE name = 'click_buckets'
+                """, aggregate_until)
+                return buckets_count
+
+
+    @timed
+    async def prune_click_buckets(self, retention: dict) -> int:
+        async with self._acquire(background=True) as conn:
+            pruned_count = 0
+            for granularity, max_age in retention.items():
+                if not max_age:
+                    continue
+                result = await conn.execute("""
+                    DELETE FROM click_buckets
+                    WHERE granularity = $1 AND bucket_start < LOCALTIMESTAMP - $2::interval
+                """, granularity, max_age)
+                pruned_count += int(result.split()[-1])
+            return pruned_count
+
+
+    @timed
+    async def get_click_histogram(self, short_url: str, granularity: str, start, end):
+        async with self._acquire(read=True, sticky=(('link', short_url),)) as conn:
+            result = await conn.fetch("""
+                SELECT bucket_start, SUM(clicks)::bigint AS clicks
+                FROM (
+                    SELECT bucket_start, clicks
+                    FROM click_buckets
+                    WHERE short_link = $1 AND granularity = $2::text
+                      AND bucket_start >= date_trunc($2::text, $3::timestamp) AND bucket_start < $4
+                    UNION ALL
+                    SELECT date_trunc($2::text, s.access_date), COUNT(*)
+                    FROM statistics s
+                    WHERE s.short_link = $1
+                      AND s.access_date >= GREATEST(
+                          date_trunc($2::text, $3::timestamp),
+                          (SELECT watermark FROM aggregation_watermarks WHERE name = 'click_buckets')
+                      )
+                      AND s.access_date < $4
+                    GROUP BY 1
+                ) buckets
+                GROUP BY bucket_start
+                ORDER BY bucket_start
+            """, short_url, granularity, start, end)
+            return jsonable_encoder([
+                {"bucket_start": row['bucket_start'], "clicks": row['clicks']} for row in result
+            ])
+
+
+    @timed
+    async def get_top_links(self, limit: int, window) -> list:
+        async with self._acquire(read=True) as conn:
+            result = await conn.fetch("""
+                SELECT l.short_link, l.full_link,
+                       EXTRACT(EPOCH FROM l.expires_at - CURRENT_TIMESTAMP)::float8 AS expires_in
+                FROM (
+                    SELECT short_link, SUM(clicks) AS clicks
+                    FROM click_buckets
+                    WHERE granularity = 'hour' AND bucket_start >= date_trunc('hour', LOCALTIMESTAMP - $2::interval)
+                    GROUP BY short_link
+                    ORDER BY clicks DESC
+                    LIMIT $1
+                ) top
+                JOIN links l ON l.short_link = top.short_link
+                WHERE l.expires_at IS NULL OR l.expires_at > CURRENT_TIMESTAMP
+                ORDER BY top.clicks DESC
+            """, limit, window)
+            return [dict(row) for row in result]
+
+
+    @timed
+    async def count_links(self) -> int:
+        async with self._acquire(background=True) as conn:
+            return await conn.fetchval("""
+                SELECT COUNT(*) FROM links
+            """)
+
+
+    async def iter_short_links(self, batch_size: int = 10000):
+        last_id = 0
+        while True:
+            async with self._acquire(background=True) as conn:
+                result = await conn.fetch("""
+                    SELECT id, short_link FROM links
+                    WHERE id > $1
+                    ORDER BY id
+                    LIMIT $2
+                """, last_id, batch_size)
+            if not result:
+                return
+            last_id = result[-1]['id']
+            yield [row['short_link'] for row in result]
+
+
     async def check_alias_availability(self, alias: str) -> bool:
         return await self.find_original_url_by_short_code(alias) is None
 
 
-    async def find_short_link_by_original_url(self, original_url: str):
-        async with self.pool.acquire() as conn:
-            logging.info("Запрос на поиск ссылки")
+    @timed
+    async def find_short_links_by_original_url(self, original_url: str, limit: int = 20, offset: int = 0) -> list:
+        async with self._acquire(read=True) as conn:
+            result = await conn.fetch("""
+                SELECT short_link FROM links
+                WHERE full_link_hash = $1 AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+                ORDER BY id
+                LIMIT $2 OFFSET $3
+            """, url_hash(original_url), limit, offset)
+            return [row['short_link'] for row in result]
+
+
+    @timed
+    async def find_user_link_by_original_url(self, original_url: str, user_id: int, expires_at) -> Optional[str]:
+        async with self._acquire() as conn:
+            return await conn.fetchval("""
+                SELECT short_link FROM links
+                WHERE full_link_hash = $1 AND user_id = $2 AND expires_at IS NOT DISTINCT FROM $3
+                  AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+                ORDER BY id
+                LIMIT 1
+            """, url_hash(original_url), user_id, expires_at)
+
+
+    @timed
+    async def backfill_full_link_hashes(self, batch_size: int = 10000) -> int:
+        updated_count = 0
+        async with self._acquire(background=True) as conn:
+            while True:
+                rows = await conn.fetch("""
+                    SELECT id, full_link FROM links WHERE full_link_hash IS NULL LIMIT $1
+                """, batch_size)
+                if not rows:
+                    return updated_count
+                await conn.executemany("""
+                    UPDATE links SET full_link_hash = $2 WHERE id = $1
+                """, [(row['id'], url_hash(row['full_link'])) for row in rows])
+                updated_count += len(rows)
+
+
+    async def open_connection(self):
+        return await asyncpg.connect(self.db_url)
+
+
+    async def try_session_lock(self, conn, lock_id: int) -> bool:
+        return await conn.fetchval("""
+            SELECT pg_try_advisory_lock($1)
+        """, lock_id)
+
+
+    def expiry_sweep_lock(self):
+        return self._advisory_lock(EXPIRY_SWEEP_LOCK_ID)
+
+
+    def statistics_partitions_lock(self):
+        return self._advisory_lock(STATISTICS_PARTITIONS_LOCK_ID)
+
+
+    @asynccontextmanager
+    async def _advisory_lock(self, lock_id: int):
+        async with self._acquire(background=True) as conn:
+            locked = await conn.fetchval("""
+                SELECT pg_try_advisory_lock($1)
+            """, lock_id)
+            try:
+                yield conn if locked else None
+            finally:
+                if locked:
+                    await conn.execute("""
+                        SELECT pg_advisory_unlock($1)
+                    """, lock_id)
+
+
+    @timed
+    async def move_expired_links_batch(self, conn, batch_size: int) -> list:
+        async with conn.transaction():
+            result = await conn.fetch("""
+                WITH moved AS (
+                    DELETE FROM links
+                    WHERE id IN (
+                        SELECT id FROM links
+                        WHERE expires_at IS NOT NULL AND expires_at < LOCALTIMESTAMP
+                        ORDER BY expires_at
+                        LIMIT $1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING full_link, short_link, created_at, expires_at, user_id, is_authorized
+                ), counters AS (
+                    DELETE FROM link_counters c
+                    USING moved m
+                    WHERE c.short_link = m.short_link
+                    RETURNING c.short_link, c.transitions_count
+                ), archived AS (
+                    INSERT INTO expired_links (full_link, short_link, created_at, expires_at, user_id, is_authorized, transitions_count)
+                    SELECT m.full_link, m.short_link, m.created_at, m.expires_at, m.user_id, m.is_authorized,
+                           COALESCE(c.transitions_count, 0)
+                    FROM moved m LEFT JOIN counters c ON c.short_link = m.short_link
+                )
+                SELECT short_link, user_id FROM moved
+            """, batch_size)
+
+            expired_by_user = {}
+            for row in result:
+                if row['user_id'] is not None:
+                    active, expired, _ = expired_by_user.get(row['user_id'], (0, 0, 0))
+                    expired_by_user[row['user_id']] = (active - 1, expired + 1, 0)
+            await self._adjust_user_counters(conn, expired_by_user)
+        return [row['short_link'] for row in result]
+
+
+    @timed
+    async def get_expiry_lag(self, conn) -> float:
+        result = await conn.fetchval("""
+            SELECT EXTRACT(EPOCH FROM LOCALTIMESTAMP - MIN(expires_at))::float8
+            FROM links
+            WHERE expires_at IS NOT NULL AND expires_at < LOCALTIMESTAMP
+        """)
+        return result or 0.0
+
+
+    @staticmethod
+    def _partition_bound(value: str) -> Optional[datetime]:
+        if value == 'MINVALUE':
+            return None
+        return datetime.fromisoformat(value.strip("'"))
+
+
+    @timed
+    async def get_statistics_partitions(self, conn) -> list:
+        result = await conn.fetch("""
+            SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'statistics'::regclass
+        """)
+        partitions = []
+        for row in result:
+            match = PARTITION_BOUND_RE.search(row['bound'])
+            partitions.append({
+                "name": row['name'],
+                "start": self._partition_bound(match.group(1)) if match else None,
+                "end": self._partition_bound(match.group(2)) if match else None,
+                "is_default": match is None,
+            })
+        return sorted(partitions, key=lambda partition: (partition['is_default'], partition['end'] or datetime.max))
+
+
+    @timed
+    async def get_statistics_maintenance_bounds(self, conn) -> dict:
+        result = await conn.fetchrow("""
+            SELECT date_trunc('day', LOCALTIMESTAMP) AS today, w.watermark,
+                   ARRAY(
+                       SELECT DISTINCT date_trunc('day', access_date) FROM statistics_default ORDER BY 1
+                   ) AS default_days
+            FROM aggregation_watermarks w
+            WHERE w.name = 'click_buckets'
+        """)
+        return dict(result)
+
+
+    @timed
+    async def create_statistics_partition(self, conn, start: datetime, end: datetime) -> str:
+        name = f"statistics_p{start:%Y%m%d}"
+        async with conn.transaction():
+            await conn.execute(f"""
+                CREATE TABLE {name} (LIKE statistics INCLUDING DEFAULTS)
+            """)
+            await conn.execute(f"""
+                WITH moved AS (
+                    DELETE FROM statistics_default
+                    WHERE access_date >= $1 AND access_date < $2
+                    RETURNING short_link, access_date, visitor_hash
+                )
+                INSERT INTO {name} (short_link, access_date, visitor_hash)
+                SELECT short_link, access_date, visitor_hash FROM moved
+            """, start, end)
+            await conn.execute(f"""
+                ALTER TABLE statistics ATTACH PARTITION {name}
+                FOR VALUES FROM ('{start.isoformat(sep=' ')}') TO ('{end.isoformat(sep=' ')}')
+            """)
+        return name
+
+
+    @timed
+    async def copy_statistics_partition(self, conn, name: str, output):
+        await conn.copy_from_table(name, output=output, format='csv', header=True)
+
+
+    @timed
+    async def drop_statistics_partition(self, conn, name: str, lock_timeout: float = 5):
+        async with conn.transaction():
+            await conn.execute(f"""
+                SET LOCAL lock_timeout = '{int(lock_timeout * 1000)}ms'
+            """)
+            await conn.execute(f"""
+                ALTER TABLE statistics DETACH PARTITION {name}
+            """)
+            await conn.execute(f"""
+                DROP TABLE {name}
+            """)
+
+
+    @timed
+    async def get_links_overview(self, user_id: int):
+        async with self._acquire(read=True, sticky=(('user', int(user_id)),)) as conn:
             result = await conn.fetchrow("""
-                SELECT short_link FROM links WHERE full_link = $1
-            """, original_url)
-            logging.info(f"Результат запроса: {result}")
+                SELECT active_links, expired_links, transitions_count
+                FROM user_link_counters
+                WHERE user_id = $1
+            """, int(user_id))
             if result:
-                return {"short_link": result['short_link']}
+                return dict(result)
             else:
-                return None
-            
-    
-    async def delete_expired_links(self):
-        async with self.pool.acquire() as conn:
-            async with conn.transaction():
-                await conn.execute("""
-                    INSERT INTO expired_links (full_link, short_link, created_at, expires_at, user_id, is_authorized)
-                    SELECT full_link, short_link, created_at, expires_at, user_id, is_authorized
-                    FROM links
-                    WHERE expires_at IS NOT NULL AND expires_at < CURRENT_TIMESTAMP
-                """)
-                
-                await conn.execute("""
-                    DELETE FROM links WHERE expires_at IS NOT NULL AND expires_at < CURRENT_TIMESTAMP
-                """)
-
+                return {"active_links": 0, "expired_links": 0, "transitions_count": 0}
+
+
+    @timed
+    async def reconcile_user_counters(self, batch_size: int = 1000) -> int:
+        async with self._acquire(background=True) as conn:
+            drifted = await conn.fetch(f"""
+                WITH actual AS (
+                    {USER_LINK_COUNTS.format(users='IS NOT NULL')}
+                )
+                SELECT COALESCE(a.user_id, u.user_id) AS user_id
+                FROM actual a
+                FULL JOIN user_link_counters u ON u.user_id = a.user_id
+                WHERE u.user_id IS NULL
+                   OR (u.active_links, u.expired_links, u.transitions_count)
+                      IS DISTINCT FROM (COALESCE(a.active_links, 0), COALESCE(a.expired_links, 0), COALESCE(a.transitions_count, 0))
+                ORDER BY 1
+            """)
+            user_ids = [row['user_id'] for row in drifted]
+
+            fixed = 0
+            for start in range(0, len(user_ids), batch_size):
+                batch = user_ids[start:start + batch_size]
+                async with conn.transaction():
+                    await conn.execute("""
+                        SELECT 1 FROM user_link_counters
+                        WHERE user_id = ANY($1::integer[])
+                        ORDER BY user_id
+                        FOR UPDATE
+                    """, batch)
+                    updated = await conn.fetch(f"""
+                        WITH actual AS (
+                            {USER_LINK_COUNTS.format(users='= ANY($1::integer[])')}
+                        )
+                        UPDATE user_link_counters c
+                        SET active_links = COALESCE(a.active_links, 0),
+                            expired_links = COALESCE(a.expired_links, 0),
+                            transitions_count = COALESCE(a.transitions_count, 0)
+                        FROM unnest($1::integer[]) AS u(user_id)
+                        LEFT JOIN actual a ON a.user_id = u.user_id
+                        WHERE c.user_id = u.user_id
+                          AND (c.active_links, c.expired_links, c.transitions_count)
+                              IS DISTINCT FROM (COALESCE(a.active_links, 0), COALESCE(a.expired_links, 0), COALESCE(a.transitions_count, 0))
+                        RETURNING c.user_id
+                    """, batch)
+                    inserted = await conn.fetch(f"""
+                        WITH actual AS (
+                            {USER_LINK_COUNTS.format(users='= ANY($1::integer[])')}
+                        )
+                        INSERT INTO user_link_counters (user_id, active_links, expired_links, transitions_count)
+                        SELECT a.user_id, a.active_links, a.expired_links, a.transitions_count
+                        FROM actual a
+                        WHERE NOT EXISTS (SELECT 1 FROM user_link_counters c WHERE c.user_id = a.user_id)
+                        ON CONFLICT (user_id) DO NOTHING
+                        RETURNING user_id
+                    """, batch)
+                fixed += len(updated) + len(inserted)
+            return fixed
 
-    async def get_links_overview(self, user_id: int):
-        async with self.pool.acquire() as conn:
-            async with conn.transaction():    
-                active_links_count = await conn.fetchval("""
-                        SELECT COUNT(*) 
-                        FROM links 
-                        WHERE user_id = $1 AND expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP;
-                    """, int(user_id))
-                    
-                if active_links_count is None:
-                        active_links_count = 0
-                    
-                expired_links_count = await conn.fetchval("""
-                        SELECT COUNT(*) 
-                        FROM expired_links 
-                        WHERE user_id = $1;
-                    """, int(user_id))
-                    
-                if expired_links_count is None:
-                        expired_links_count = 0
-                    
-                return {
-                        "active_links": active_links_count,
-                        "expired_links": expired_links_count
-                    }
 
     async def close(self):
         if self.pool:
             await self.pool.close()
+        for replica in self.replicas:
+            if replica.pool:
+                await replica.pool.close()
+                replica.pool = None
+            replica.healthy = False
+
+
+    def observe_pools(self):
+        if self.pool is not None:
+            observe_pool(self.pool, 'primary')
+        for replica in self.replicas:
+            if replica.pool is not None:
+                observe_pool(replica.pool, replica.name)
 
             
\ No newline at end of file
@@ -0,0 +1,123 @@
+import json
+import hashlib
+import logging
+import functools
+
+from typing import Callable, Iterable, Optional
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+from urls import url_hash
+from metrics import RESPONSE_CACHE_HIT, RESPONSE_CACHE_MISS
+
+logging.basicConfig(level=logging.INFO)
+
+
+def link_tag(short_code: str) -> str:
+    return f"link:{short_code}"
+
+
+def user_tag(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def url_tag(full_link: str) -> str:
+    return f"url:{url_hash(full_link)}"
+
+
+class ResponseCache:
+    def __init__(self, redis, prefix: str = 'response:', tag_prefix: str = 'response-tag:'):
+        self.redis = redis
+        self.prefix = prefix
+        self.tag_prefix = tag_prefix
+
+
+    @staticmethod
+    def _credentials(request: Request):
+        user_id = request.headers.get('X-User-Id')
+        authorization = request.headers.get('Authorization')
+        if not user_id or not authorization or len(authorization.split()) != 2:
+            return None
+        try:
+            return int(user_id), authorization.split()[1]
+        except ValueError:
+            return None
+
+
+    def key(self, request: Request, user_id: Optional[int] = None, token: Optional[str] = None) -> str:
+        parts = [request.method, request.url.path, *(f"{name}={value}" for name, value in sorted(request.query_params.multi_items()))]
+        if user_id is not None:
+            parts += [str(user_id), token]
+        return self.prefix + hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+
+    def cached(self, expire: int, per_user: bool = False, tags: Optional[Callable[[dict, object], Iterable[str]]] = None):
+        def decorator(endpoint):
+            @functools.wraps(endpoint)
+            async def wrapper(*args, **kwargs):
+                request = kwargs['request']
+                user_id = token = None
+                if per_user:
+                    credentials = self._credentials(request)
+                    if credentials is None:
+                        return await endpoint(*args, **kwargs)
+                    user_id, token = credentials
+
+                key = self.key(request, user_id, token)
+                cached = await self.get(key)
+                if cached is not None:
+                    RESPONSE_CACHE_HIT.inc()
+                    return Response(content=cached, media_type='application/json')
+                RESPONSE_CACHE_MISS.inc()
+
+                result = await endpoint(*args, **kwargs)
+                if isinstance(result, Response):
+                    return result
+
+                content = jsonable_encoder(result)
+                body = json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode()
+                route_tags = list(tags(kwargs, content)) if tags is not None else []
+                if user_id is not None:
+                    route_tags.append(user_tag(user_id))
+                await self.set(key, body, expire, route_tags)
+                return Response(content=body, media_type='application/json')
+            return wrapper
+        return decorator
+
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            return await self.redis.get(key)
+        except Exception:
+            logging.exception("Не удалось прочитать ответ из кэша")
+            return None
+
+
+    async def set(self, key: str, body: bytes, expire: int, tags: Iterable[str]):
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            pipeline.set(key, body, ex=expire)
+            for tag in tags:
+                pipeline.sadd(self.tag_prefix + tag, key)
+                pipeline.expire(self.tag_prefix + tag, expire)
+            await pipeline.execute()
+        except Exception:
+            logging.exception("Не удалось сохранить ответ в кэш")
+
+
+    async def invalidate_tags(self, tags: Iterable[str]):
+        tag_keys = [self.tag_prefix + tag for tag in tags]
+        if not tag_keys:
+            return
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for tag_key in tag_keys:
+                pipeline.smembers(tag_key)
+            members = await pipeline.execute()
+
+            keys = {key for tag_members in members for key in tag_members}
+            await self.redis.delete(*keys, *tag_keys)
+        except Exception:
+            logging.exception(f"Не удалось сбросить кэш ответов по тегам: {tag_keys}")
@@ -1,36 +1,183 @@
 import asyncio
 import logging
-import random
-import string
 
 from repository import Repository
+from cache import LinkCache, CredentialCache, SharedLinkCache, MISSING
+from bloom import SharedLinkFilter
+from visitors import UniqueVisitorCounter, MAX_VISITOR_DAYS
+from hotkeys import HotLinkPinner
+from clicks import ClickRecorder
+from codes import CodeAllocator
+from bulk import BulkParseError
+from response_cache import ResponseCache, link_tag, user_tag, url_tag
+from metrics import LINK_CACHE_HIT, LINK_CACHE_NEGATIVE_HIT, LINK_CACHE_MISS, CREDENTIAL_CACHE_HIT, CREDENTIAL_CACHE_MISS, LINK_FILTER_REJECTED, LINK_CACHE_WARMED
 from typing import Optional
 from fastapi import HTTPException
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
 
 logging.basicConfig(level=logging.INFO)
 
+GRANULARITY_STEPS = {
+    'minute': timedelta(minutes=1),
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+}
+DEFAULT_HISTOGRAM_RANGES = {
+    'minute': timedelta(hours=1),
+    'hour': timedelta(days=1),
+    'day': timedelta(days=30),
+}
+MAX_HISTOGRAM_BUCKETS = 5000
+
 class Service:
     _instance = None
 
-    def __new__(cls, repository: Repository):
+    def __new__(cls, repository: Repository, link_cache: Optional[LinkCache] = None, click_recorder: Optional[ClickRecorder] = None,
+                code_allocator: Optional[CodeAllocator] = None, credential_cache: Optional[CredentialCache] = None,
+                shared_link_cache: Optional[SharedLinkCache] = None, response_cache: Optional[ResponseCache] = None,
+                link_filter: Optional[SharedLinkFilter] = None, visitor_counter: Optional[UniqueVisitorCounter] = None,
+                hot_links: Optional[HotLinkPinner] = None):
         if cls._instance is None:
             cls._instance = super(Service, cls).__new__(cls)
             cls._instance.repository = repository
+            cls._instance.link_cache = link_cache if link_cache is not None else LinkCache()
+            cls._instance.click_recorder = click_recorder if click_recorder is not None else ClickRecorder(repository)
+            cls._instance.code_allocator = code_allocator if code_allocator is not None else CodeAllocator(repository)
+            cls._instance.credential_cache = credential_cache if credential_cache is not None else CredentialCache()
+            cls._instance.shared_link_cache = shared_link_cache
+            cls._instance.response_cache = response_cache
+            cls._instance.link_filter = link_filter
+            cls._instance.visitor_counter = visitor_counter
+            cls._instance.hot_links = hot_links
+            cls._instance.link_loads = {}
         return cls._instance
 
         
-    async def get_original_url(self, short_code: str):
-        await self.repository.save_access_statistics(short_code)
-        return await self.repository.find_original_url_by_short_code(short_code)
+    async def get_original_url(self, short_code: str, client_ip: Optional[str] = None, user_agent: Optional[str] = None):
+        full_link = await self._resolve_short_code(short_code)
+        if full_link is not None:
+            if self.hot_links is not None:
+                self.hot_links.record(short_code)
+            visitor_hash = None
+            if self.visitor_counter is not None and client_ip is not None:
+                visitor_hash = self.visitor_counter.visitor_hash(client_ip, user_agent)
+            await self.click_recorder.record(short_code, visitor_hash)
+        return full_link
+
+
+    async def _resolve_short_code(self, short_code: str):
+        full_link = self.link_cache.get(short_code)
+        if full_link is not MISSING:
+            if full_link is None:
+                LINK_CACHE_NEGATIVE_HIT.inc()
+            else:
+                LINK_CACHE_HIT.inc()
+            return full_link
+
+        LINK_CACHE_MISS.inc()
+        if self.link_filter is not None and not self.link_filter.might_contain(short_code):
+            LINK_FILTER_REJECTED.inc()
+            return None
+
+        load = self.link_loads.get(short_code)
+        if load is None:
+            load = asyncio.ensure_future(self._load_link(short_code))
+            self.link_loads[short_code] = load
+            load.add_done_callback(lambda _: self._forget_link_load(short_code, load))
+        return await asyncio.shield(load)
+
+
+    async def _load_link(self, short_code: str):
+        load = asyncio.current_task()
+        if self.shared_link_cache is not None:
+            cached = await self.shared_link_cache.get(short_code)
+            if cached is not MISSING:
+                full_link, expires_in = cached
+                if self.link_loads.get(short_code) is load:
+                    self.link_cache.set(short_code, full_link, expires_in)
+                return full_link
+
+        link = await self.repository.find_link_by_short_code(short_code)
+        full_link, expires_in = (link['full_link'], link['expires_in']) if link is not None else (None, None)
+        if self.link_loads.get(short_code) is load:
+            self.link_cache.set(short_code, full_link, expires_in)
+            if self.shared_link_cache is not None:
+                await self.shared_link_cache.set(short_code, full_link, expires_in)
+        return full_link
+
+
+    def _forget_link_load(self, short_code: str, load: asyncio.Future):
+        if self.link_loads.get(short_code) is load:
+            del self.link_loads[short_code]
+
+
+    async def warm_up_link_cache(self, limit: int, window: timedelta) -> int:
+        links = await self.repository.get_top_links(min(limit, self.link_cache.max_size), window)
+        for link in reversed(links):
+            self.link_cache.set(link['short_link'], link['full_link'], link['expires_in'])
+        LINK_CACHE_WARMED.set(len(links))
+        logging.info(f"Кэш ссылок прогрет {len(links)} самыми популярными ссылками")
+        return len(links)
+
+
+    def evict_local_links(self, short_codes: Optional[list]):
+        if short_codes is None:
+            self.link_cache.clear(keep_pinned=True)
+            self.link_loads.clear()
+            return
+        self.link_cache.invalidate_many(short_codes)
+        for short_code in short_codes:
+            self.link_loads.pop(short_code, None)
+
+
+    async def invalidate_links(self, short_codes, user_id: Optional[int] = None, full_links=()):
+        short_codes = list(short_codes)
+        self.evict_local_links(short_codes)
+        if self.shared_link_cache is not None:
+            await self.shared_link_cache.invalidate_many(short_codes)
+        if self.response_cache is not None:
+            tags = [link_tag(short_code) for short_code in short_codes]
+            tags += [url_tag(full_link) for full_link in set(full_links)]
+            if user_id is not None:
+                tags.append(user_tag(user_id))
+            await self.response_cache.invalidate_tags(tags)
     
 
-    async def delete_link(self, short_code: str, user_id: int, token: str) -> bool:
+    async def authenticate(self, user_id: int, token: str) -> Optional[dict]:
+        user = self.credential_cache.get(user_id, token)
+        if user is not None:
+            CREDENTIAL_CACHE_HIT.inc()
+            return user
+
+        CREDENTIAL_CACHE_MISS.inc()
         user = await self.repository.find_user_by_token_and_id(user_id, token)
         if user:
-            author_id = await self.repository.get_link_author(short_code)
-            if user['id'] == author_id:
-                await self.repository.delete_link(short_code)
+            self.credential_cache.set(user_id, token, user)
+        return user
+
+
+    async def _links_created(self, short_codes):
+        if self.link_filter is not None:
+            await self.link_filter.add_many(short_codes)
+
+
+    async def rotate_user_token(self, user_id: int, token: str) -> bool:
+        updated = await self.repository.update_user_token(user_id, token)
+        self.credential_cache.invalidate_user(user_id)
+        if self.response_cache is not None:
+            await self.response_cache.invalidate_tags([user_tag(user_id)])
+        return updated
+
+
+    def invalidate_user_credentials(self, user_id: int):
+        self.credential_cache.invalidate_user(user_id)
+
+
+    async def delete_link(self, short_code: str, user_id: int, token: str) -> bool:
+        user = await self.authenticate(user_id, token)
+        if user:
+            if await self.repository.delete_link_by_owner(short_code, user['id']):
+                await self.invalidate_links([short_code], user['id'])
                 return True
             else:
                 return False
@@ -39,11 +186,10 @@ class Service:
         
 
     async def update_url(self, short_code: str, long_url: str, user_id: int, token: str) -> bool:
-        user = await self.repository.find_user_by_token_and_id(user_id, token)
+        user = await self.authenticate(user_id, token)
         if user:
-            author_id = await self.repository.get_link_author(short_code)
-            if user['id'] == author_id:
-                await self.repository.update_long_link(short_code, long_url)
+            if await self.repository.update_long_link_by_owner(short_code, long_url, user['id']):
+                await self.invalidate_links([short_code], user['id'], [long_url])
                 return True
             else:
                 return False
@@ -52,41 +198,105 @@ class Service:
         
 
     async def get_stats(self, short_code: str, user_id: int, token: str):
-        user = await self.repository.find_user_by_token_and_id(user_id, token)
+        user = await self.authenticate(user_id, token)
         if not user:
             return None
 
-        author_id = await self.repository.get_link_author(short_code)
+        stats = await self.repository.get_link_stats(short_code, user['id'])
+        if stats:
+            if self.visitor_counter is not None:
+                stats["unique_visitors"] = await self.visitor_counter.count(short_code)
+            return stats
+        else:
+            return None
+        
+
+    async def get_click_histogram(self, short_code: str, user_id: int, token: str, granularity: str, start: Optional[datetime] = None, end: Optional[datetime] = None):
+        if granularity not in GRANULARITY_STEPS:
+            raise HTTPException(status_code=400, detail="Unknown granularity")
 
-        if author_id is None:
+        end = self._to_utc(end) if end else datetime.now(timezone.utc).replace(tzinfo=None)
+        start = self._to_utc(start) if start else end - DEFAULT_HISTOGRAM_RANGES[granularity]
+        if start >= end:
+            raise HTTPException(status_code=400, detail="Invalid time range")
+        if (end - start) / GRANULARITY_STEPS[granularity] > MAX_HISTOGRAM_BUCKETS:
+            raise HTTPException(status_code=400, detail="Time range is too large for this granularity")
+
+        user = await self.authenticate(user_id, token)
+        if not user:
             return None
 
-        if user['id'] != author_id:
+        author_id = await self.repository.get_link_author(short_code)
+        if author_id is None or user['id'] != author_id:
             return None
 
-        stats = await self.repository.get_link_stats(short_code)
-        if stats:
-            return stats
-        else:
+        buckets = await self.repository.get_click_histogram(short_code, granularity, start, end)
+        return {
+            "short_url": short_code,
+            "granularity": granularity,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "buckets": buckets
+        }
+
+
+    async def get_unique_visitors(self, short_code: str, user_id: int, token: str, start: Optional[date] = None, end: Optional[date] = None):
+        if self.visitor_counter is None:
+            raise HTTPException(status_code=404, detail="Unique visitors are not tracked")
+
+        end = end or datetime.now(timezone.utc).date()
+        start = start or end - timedelta(days=6)
+        if start > end:
+            raise HTTPException(status_code=400, detail="Invalid date range")
+        if (end - start).days >= MAX_VISITOR_DAYS:
+            raise HTTPException(status_code=400, detail="Date range is too large")
+
+        user = await self.authenticate(user_id, token)
+        if not user:
             return None
-        
+
+        author_id = await self.repository.get_link_author(short_code)
+        if author_id is None or user['id'] != author_id:
+            return None
+
+        visitors = await self.visitor_counter.count_days(short_code, start, end)
+        if visitors is None:
+            raise HTTPException(status_code=503, detail="Unique visitors are temporarily unavailable")
+        return {
+            "short_url": short_code,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            **visitors
+        }
+
+
+    @staticmethod
+    def _to_utc(value: datetime) -> datetime:
+        if value.tzinfo is None:
+            return value
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+
 
     async def create_short_link(self, full_link: str, user_id: int = None, is_authorized: bool = False, expires_at: Optional[datetime] = None) -> Optional[dict]:
-        symbols = string.ascii_letters + string.digits
-        max_attempts = 50
-        attempts = 0
-        
-        while attempts < max_attempts:
-            short_link = ''.join(random.choice(symbols) for _ in range(6))
-            
-            if await self.repository.find_original_url_by_short_code(short_link) is None:
+        if user_id is not None:
+            existing_short_link = await self.repository.find_user_link_by_original_url(full_link, user_id, expires_at)
+            if existing_short_link:
+                return {
+                    "status_code": 200,
+                    "short_link": existing_short_link
+                }
+
+        max_attempts = 10
+
+        for _ in range(max_attempts):
+            short_link = await self.code_allocator.next_code()
+            if await self.repository.save_link_with_user(full_link, short_link, user_id, is_authorized, expires_at):
                 break
-            attempts += 1
-        
-        if attempts == max_attempts:
+        else:
             return None
-        
-        await self.repository.save_link_with_user(full_link, short_link, user_id, is_authorized, expires_at)
+
+        await self._links_created([short_link])
+        await self.invalidate_links([short_link], user_id, [full_link])
         
         return {
             "status_code": 201,
@@ -95,10 +305,10 @@ class Service:
     
     
     async def create_short_link_with_custom_alias(self, full_link: str, custom_alias: str, user_id: int = None, is_authorized: bool = False, expires_at: Optional[datetime] = None) -> Optional[dict]:
-        if await self.repository.find_original_url_by_short_code(custom_alias):
+        if not await self.repository.save_link_with_user(full_link, custom_alias, user_id, is_authorized, expires_at):
             raise HTTPException(status_code=400, detail="Alias already exists")
-        
-        await self.repository.save_link_with_user(full_link, custom_alias, user_id, is_authorized, expires_at)
+        await self._links_created([custom_alias])
+        await self.invalidate_links([custom_alias], user_id, [full_link])
         
         return {
             "status_code": 201,
@@ -106,11 +316,76 @@ class Service:
         }
     
 
+    async def create_short_links_bulk(self, items, user_id: int = None, is_authorized: bool = False, chunk_size: int = 1000):
+        chunk = []
+        try:
+            async for index, item in items:
+                if isinstance(item, BulkParseError):
+                    yield {"index": index, "error": str(item)}
+                    continue
+                chunk.append((index, item))
+                if len(chunk) >= chunk_size:
+                    for result in await self._save_links_chunk(chunk, user_id, is_authorized):
+                        yield result
+                    chunk = []
+        except BulkParseError as e:
+            for result in await self._save_links_chunk(chunk, user_id, is_authorized):
+                yield result
+            yield {"error": str(e)}
+            return
+
+        for result in await self._save_links_chunk(chunk, user_id, is_authorized):
+            yield result
+
+
+    async def _save_links_chunk(self, chunk: list, user_id: int, is_authorized: bool) -> list:
+        results = []
+        pending = []
+        aliases = set()
+        for index, link_request in chunk:
+            custom_alias = getattr(link_request, 'custom_alias', None)
+            if custom_alias is not None:
+                if custom_alias in aliases:
+                    results.append({"index": index, "error": "Alias already exists"})
+                    continue
+                aliases.add(custom_alias)
+            pending.append((index, link_request, custom_alias))
+
+        max_attempts = 10
+        for _ in range(max_attempts):
+            if not pending:
+                break
+
+            codes = iter(await self.code_allocator.next_codes(sum(1 for _, _, alias in pending if alias is None)))
+            rows = [(index, link_request, alias, alias if alias is not None else next(codes)) for index, link_request, alias in pending]
+            created = await self.repository.save_links_batch([
+                (link_request.link, short_link, user_id, is_authorized, link_request.expires_at)
+                for _, link_request, _, short_link in rows
+            ])
+            await self._links_created(created)
+            await self.invalidate_links(created, user_id, [
+                link_request.link for _, link_request, _, short_link in rows if short_link in created
+            ])
+
+            pending = []
+            for index, link_request, alias, short_link in rows:
+                if short_link in created:
+                    results.append({"index": index, "short_link": short_link})
+                elif alias is not None:
+                    results.append({"index": index, "error": "Alias already exists"})
+                else:
+                    pending.append((index, link_request, None))
+
+        for index, _, _ in pending:
+            results.append({"index": index, "error": "Failed to shorten link"})
+
+        return sorted(results, key=lambda result: result['index'])
+
+
     async def get_links_overview(self, user_id: int):
         return await self.repository.get_links_overview(user_id)
     
     
-    async def find_short_link_by_original_url(self, original_url: str) -> Optional[dict]:
-        logging.info("Попали в сервисный класс")
-        return await self.repository.find_short_link_by_original_url(original_url)
+    async def find_short_links_by_original_url(self, original_url: str, limit: int = 20, offset: int = 0) -> list:
+        return await self.repository.find_short_links_by_original_url(original_url, limit, offset)
     
\ No newline at end of file
@@ -0,0 +1,85 @@
+import time
+import asyncio
+import inspect
+import logging
+
+from typing import Awaitable, Callable, Iterable, Optional, Union
+
+from repository import Repository
+from metrics import SWEEPER_RUNS, SWEEPER_ROWS_MOVED, SWEEPER_RUN_DURATION, SWEEPER_LAG, SWEEPER_BATCH_SIZE
+
+logging.basicConfig(level=logging.INFO)
+
+
+class ExpirySweeper:
+    def __init__(self, repository: Repository, on_expired: Optional[Callable[[Iterable[str]], Union[None, Awaitable[None]]]] = None,
+                 batch_size: int = 1000, min_batch_size: int = 100, max_batch_size: int = 10000,
+                 target_batch_seconds: float = 0.2, pause_ratio: float = 1.0, max_run_seconds: float = 30):
+        self.repository = repository
+        self.on_expired = on_expired
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_batch_seconds = target_batch_seconds
+        self.pause_ratio = pause_ratio
+        self.max_run_seconds = max_run_seconds
+        self.runs = 0
+        self.skipped_runs = 0
+        self.total_rows_moved = 0
+        self.last_run = None
+
+
+    async def run(self) -> Optional[dict]:
+        async with self.repository.expiry_sweep_lock() as conn:
+            if conn is None:
+                self.skipped_runs += 1
+                SWEEPER_RUNS.labels('skipped').inc()
+                logging.info("Очистка просроченных ссылок уже выполняется другим экземпляром")
+                return None
+
+            started = time.monotonic()
+            rows_moved = 0
+            batches = 0
+            while True:
+                batch_started = time.monotonic()
+                batch_size = self.batch_size
+                expired_codes = await self.repository.move_expired_links_batch(conn, batch_size)
+                batch_seconds = time.monotonic() - batch_started
+
+                batches += 1
+                rows_moved += len(expired_codes)
+                if expired_codes and self.on_expired is not None:
+                    result = self.on_expired(expired_codes)
+                    if inspect.isawaitable(result):
+                        await result
+
+                self._adapt_batch_size(batch_seconds)
+                if len(expired_codes) < batch_size or time.monotonic() - started >= self.max_run_seconds:
+                    break
+                await asyncio.sleep(batch_seconds * self.pause_ratio)
+
+            lag_seconds = await self.repository.get_expiry_lag(conn)
+
+        self.runs += 1
+        self.total_rows_moved += rows_moved
+        self.last_run = {
+            "rows_moved": rows_moved,
+            "batches": batches,
+            "duration_seconds": time.monotonic() - started,
+            "lag_seconds": lag_seconds,
+            "batch_size": self.batch_size,
+        }
+        SWEEPER_RUNS.labels('completed').inc()
+        SWEEPER_ROWS_MOVED.inc(rows_moved)
+        SWEEPER_RUN_DURATION.observe(self.last_run["duration_seconds"])
+        SWEEPER_BATCH_SIZE.set(self.batch_size)
+        SWEEPER_LAG.set(lag_seconds)
+        logging.info(f"Очистка просроченных ссылок: {self.last_run}")
+        return self.last_run
+
+
+    def _adapt_batch_size(self, batch_seconds: float):
+        if batch_seconds > self.target_batch_seconds * 1.5:
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+        elif batch_seconds < self.target_batch_seconds / 2:
+            self.batch_size = min(self.max_batch_size, self.batch_size * 2)
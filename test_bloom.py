@@ -0,0 +1,137 @@
+import json
+import asyncio
+import pytest
+
+from bloom import BloomFilter, SharedLinkFilter
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.published = []
+        self.available = True
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value if isinstance(value, bytes) else str(value).encode()
+        return True
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def setbit(self, key, offset, value):
+        bits = bytearray(self.values.get(key, b''))
+        if len(bits) <= offset >> 3:
+            bits.extend(b'\0' * ((offset >> 3) + 1 - len(bits)))
+        bits[offset >> 3] |= 0x80 >> (offset & 7)
+        self.values[key] = bytes(bits)
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+        return command
+
+    async def execute(self):
+        if not self.redis.available:
+            raise ConnectionError("redis is down")
+        results = []
+        for name, args, kwargs in self.commands:
+            result = getattr(self.redis, name)(*args, **kwargs)
+            if hasattr(result, '__await__'):
+                result = await result
+            results.append(result)
+        return results
+
+
+class FakeRepository:
+    def __init__(self, short_links):
+        self.short_links = short_links
+
+    async def count_links(self):
+        return len(self.short_links)
+
+    async def iter_short_links(self, batch_size=2):
+        for start in range(0, len(self.short_links), batch_size):
+            yield self.short_links[start:start + batch_size]
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter.for_capacity(10000, 0.01)
+    items = [f"code{i}" for i in range(10000)]
+    for item in items:
+        bloom.add(item)
+
+    assert all(item in bloom for item in items)
+    false_positives = sum(f"other{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+@pytest.mark.asyncio
+async def test_filter_is_shared_through_redis():
+    redis = FakeRedis()
+    builder = SharedLinkFilter(redis, FakeRepository(["a", "b", "c"]), min_capacity=1000)
+    assert builder.might_contain("anything")
+
+    assert await builder.rebuild()
+    assert builder.might_contain("a")
+    assert not builder.might_contain("missing")
+
+    await builder.add_many(["d"])
+    worker = SharedLinkFilter(redis, FakeRepository([]), min_capacity=1000)
+    assert await worker.load()
+    assert worker.version == builder.version
+    assert all(worker.might_contain(code) for code in ("a", "b", "c", "d"))
+    assert not worker.might_contain("missing")
+
+
+@pytest.mark.asyncio
+async def test_rebuild_is_exclusive_and_replays_recent_codes():
+    redis = FakeRedis()
+    link_filter = SharedLinkFilter(redis, FakeRepository(["a"]), min_capacity=1000)
+    await redis.set(link_filter.lock_key, 1)
+    assert not await link_filter.rebuild()
+
+    await redis.delete(link_filter.lock_key)
+    link_filter._add_local(["created_elsewhere"])
+    assert await link_filter.rebuild()
+    assert link_filter.might_contain("created_elsewhere")
+
+
+@pytest.mark.asyncio
+async def test_failed_publish_disables_filter_until_codes_are_shared():
+    redis = FakeRedis()
+    link_filter = SharedLinkFilter(redis, FakeRepository(["a"]), min_capacity=1000)
+    assert await link_filter.rebuild()
+
+    redis.available = False
+    await link_filter.add_many(["b"])
+    assert link_filter.filter is None
+    assert link_filter.might_contain("missing")
+
+    redis.available = True
+    await asyncio.wait_for(link_filter._recovery, 1)
+    assert not link_filter.pending
+    assert link_filter.might_contain("b")
+    assert not link_filter.might_contain("missing")
+    assert json.loads(redis.published[-1][1]) == {"add": ["b"]}
+
+    worker = SharedLinkFilter(redis, FakeRepository([]), min_capacity=1000)
+    assert await worker.load()
+    assert worker.might_contain("b")
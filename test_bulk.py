@@ -0,0 +1,45 @@
+import pytest
+
+from bulk import iter_bulk_items, BulkParseError
+from entity import LinkRequest, CustomLinkRequest
+
+
+async def chunked(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+async def collect(items):
+    return [item async for item in items]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+async def test_json_array(chunk_size):
+    body = '[{"link": "https://a.com"}, {"link": "https://b.com", "custom_alias": "bé"}, 42]'.encode()
+    items = await collect(iter_bulk_items(chunked(body, chunk_size), 'application/json'))
+
+    assert [index for index, _ in items] == [0, 1, 2]
+    assert isinstance(items[0][1], LinkRequest)
+    assert isinstance(items[1][1], CustomLinkRequest)
+    assert items[1][1].custom_alias == "bé"
+    assert isinstance(items[2][1], BulkParseError)
+
+
+@pytest.mark.asyncio
+async def test_json_array_truncated():
+    with pytest.raises(BulkParseError):
+        await collect(iter_bulk_items(chunked(b'[{"link": "https://a.com"}, {"li', 5), 'application/json'))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [1, 10, 4096])
+async def test_ndjson(chunk_size):
+    body = b'{"link": "https://a.com"}\n\nnot json\n{"expires_at": null}\n{"link": "https://c.com"}'
+    items = await collect(iter_bulk_items(chunked(body, chunk_size), 'application/x-ndjson; charset=utf-8'))
+
+    assert [index for index, _ in items] == [0, 1, 2, 3]
+    assert items[0][1].link == "https://a.com"
+    assert isinstance(items[1][1], BulkParseError)
+    assert isinstance(items[2][1], BulkParseError)
+    assert items[3][1].link == "https://c.com"
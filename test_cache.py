@@ -0,0 +1,250 @@
+import json
+import asyncio
+import pytest
+
+import cache
+
+from cache import LinkCache, CredentialCache, SharedLinkCache, MISSING
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.published = []
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, px=None, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, key, value, px=None):
+        self.commands.append(('set', key, value))
+
+    def publish(self, channel, message):
+        self.commands.append(('publish', channel, message))
+
+    async def execute(self):
+        for command, key, value in self.commands:
+            if command == 'set':
+                self.redis.values[key] = value
+            else:
+                self.redis.published.append((key, value))
+
+
+def test_get_and_set(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    link_cache = LinkCache(max_size=10, ttl=60)
+
+    assert link_cache.get("abc") is MISSING
+    link_cache.set("abc", "http://test_link.com")
+    assert link_cache.get("abc") == "http://test_link.com"
+
+    clock.now += 61
+    assert link_cache.get("abc") is MISSING
+
+
+def test_negative_caching(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    link_cache = LinkCache(max_size=10, ttl=60, negative_ttl=5)
+
+    link_cache.set("unknown", None)
+    assert link_cache.get("unknown") is None
+
+    clock.now += 6
+    assert link_cache.get("unknown") is MISSING
+
+
+def test_expires_at_is_honoured(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    link_cache = LinkCache(max_size=10, ttl=60)
+
+    link_cache.set("abc", "http://test_link.com", expires_in=10)
+    clock.now += 9
+    assert link_cache.get("abc") == "http://test_link.com"
+    clock.now += 1
+    assert link_cache.get("abc") is MISSING
+
+    link_cache.set("expired", "http://test_link.com", expires_in=-1)
+    assert link_cache.get("expired") is MISSING
+
+
+def test_lru_eviction():
+    link_cache = LinkCache(max_size=2, ttl=60)
+    link_cache.set("a", "http://a.com")
+    link_cache.set("b", "http://b.com")
+    link_cache.get("a")
+    link_cache.set("c", "http://c.com")
+
+    assert link_cache.get("a") == "http://a.com"
+    assert link_cache.get("b") is MISSING
+    assert link_cache.get("c") == "http://c.com"
+
+
+def test_invalidate():
+    link_cache = LinkCache(max_size=10, ttl=60)
+    link_cache.set("a", "http://a.com")
+    link_cache.set("b", "http://b.com")
+    link_cache.set("c", "http://c.com")
+
+    link_cache.invalidate("a")
+    link_cache.invalidate_many(["b", "missing"])
+
+    assert link_cache.get("a") is MISSING
+    assert link_cache.get("b") is MISSING
+    assert link_cache.get("c") == "http://c.com"
+
+
+def test_pinned_links_skip_lru_eviction(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    link_cache = LinkCache(max_size=1, ttl=60)
+    link_cache.set("hot", "http://hot.com")
+    assert link_cache.pin("hot")
+    assert not link_cache.pin("missing")
+
+    link_cache.set("a", "http://a.com")
+    link_cache.set("b", "http://b.com")
+    assert link_cache.get("hot") == "http://hot.com"
+    assert link_cache.get("a") is MISSING
+
+    previous = link_cache.pinned()["hot"]
+    clock.now += 55
+    assert link_cache.refresh_pinned("hot", previous, "http://hot.com/v2", None)
+    clock.now += 30
+    assert link_cache.get("hot") == "http://hot.com/v2"
+
+    previous = link_cache.pinned()["hot"]
+    link_cache.invalidate("hot")
+    assert not link_cache.refresh_pinned("hot", previous, "http://stale.com", None)
+    assert link_cache.get("hot") is MISSING
+
+
+def test_credential_cache(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    credential_cache = CredentialCache(max_size=10, ttl=30)
+
+    credential_cache.set(1, "token1", {"id": 1})
+    assert credential_cache.get(1, "token1") == {"id": 1}
+    assert credential_cache.get(1, "wrong_token") is None
+    assert credential_cache.get(2, "token1") is None
+
+    clock.now += 31
+    assert credential_cache.get(1, "token1") is None
+
+
+def test_credential_cache_invalidate_user():
+    credential_cache = CredentialCache(max_size=10, ttl=30)
+    credential_cache.set(1, "token1", {"id": 1})
+    credential_cache.set(1, "token1_old", {"id": 1})
+    credential_cache.set(2, "token2", {"id": 2})
+
+    credential_cache.invalidate_user(1)
+
+    assert credential_cache.get(1, "token1") is None
+    assert credential_cache.get(1, "token1_old") is None
+    assert credential_cache.get(2, "token2") == {"id": 2}
+
+
+@pytest.mark.asyncio
+async def test_shared_link_cache():
+    redis = FakeRedis()
+    shared_cache = SharedLinkCache(redis)
+
+    assert await shared_cache.get("abc") is MISSING
+    await shared_cache.set("abc", "http://test_link.com")
+    await shared_cache.set("unknown", None)
+
+    assert await shared_cache.get("abc") == ("http://test_link.com", None)
+    assert await shared_cache.get("unknown") == (None, None)
+
+    await shared_cache.set("expiring", "http://test_link.com", expires_in=10)
+    full_link, expires_in = await shared_cache.get("expiring")
+    assert full_link == "http://test_link.com"
+    assert 9 < expires_in <= 10
+
+
+@pytest.mark.asyncio
+async def test_shared_link_cache_invalidation_blocks_stale_writes():
+    redis = FakeRedis()
+    shared_cache = SharedLinkCache(redis)
+    await shared_cache.set("abc", "http://old_link.com")
+
+    await shared_cache.invalidate_many(["abc"])
+    assert await shared_cache.get("abc") is MISSING
+    assert redis.published == [("link-cache-invalidation", json.dumps(["abc"]))]
+
+    await shared_cache.set("abc", "http://old_link.com")
+    assert await shared_cache.get("abc") is MISSING
+
+
+class FakePubSub:
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def subscribe(self, channel):
+        pass
+
+    async def listen(self):
+        while True:
+            message = await self.messages.get()
+            if isinstance(message, Exception):
+                raise message
+            yield message
+
+    async def close(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_shared_link_cache_flushes_only_after_reconnect():
+    messages = asyncio.Queue()
+    redis = FakeRedis()
+    redis.pubsub = lambda: FakePubSub(messages)
+    shared_cache = SharedLinkCache(redis)
+    invalidated = []
+
+    await shared_cache.start(invalidated.append)
+    await messages.put({'type': 'message', 'data': json.dumps(["abc"])})
+    await asyncio.sleep(0.01)
+    assert invalidated == [["abc"]]
+
+    await messages.put(ConnectionError("connection lost"))
+    await asyncio.sleep(0.2)
+    await shared_cache.stop()
+    assert invalidated == [["abc"], None]
+
+
+def test_clear_can_keep_pinned_links():
+    link_cache = LinkCache(max_size=10)
+    link_cache.set("hot", "http://hot_link.com")
+    link_cache.set("cold", "http://cold_link.com")
+    link_cache.pin("hot")
+
+    link_cache.clear(keep_pinned=True)
+    assert link_cache.get("hot") == "http://hot_link.com"
+    assert link_cache.get("cold") is MISSING
@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+
+from clicks import ClickRecorder
+
+
+class FakeRepository:
+    def __init__(self):
+        self.batches = []
+
+    async def save_access_statistics_batch(self, records):
+        self.batches.append(list(records))
+
+
+@pytest.mark.asyncio
+async def test_flush_in_batches():
+    repo = FakeRepository()
+    recorder = ClickRecorder(repo, max_queue_size=100, batch_size=2)
+    for short_code in ("a", "b", "c"):
+        await recorder.record(short_code)
+
+    await recorder.flush()
+    assert [[code for code, *_ in batch] for batch in repo.batches] == [["a", "b"], ["c"]]
+
+
+@pytest.mark.asyncio
+async def test_drop_policy():
+    repo = FakeRepository()
+    recorder = ClickRecorder(repo, max_queue_size=2, batch_size=10, overflow_policy='drop')
+    for short_code in ("a", "b", "c"):
+        await recorder.record(short_code)
+
+    await recorder.flush()
+    assert recorder.dropped == 1
+    assert [code for code, *_ in repo.batches[0]] == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_policy():
+    repo = FakeRepository()
+    recorder = ClickRecorder(repo, max_queue_size=2, batch_size=10, overflow_policy='drop_oldest')
+    for short_code in ("a", "b", "c"):
+        await recorder.record(short_code)
+
+    await recorder.flush()
+    assert recorder.dropped == 1
+    assert [code for code, *_ in repo.batches[0]] == ["b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_background_flush_and_drain_on_stop():
+    repo = FakeRepository()
+    recorder = ClickRecorder(repo, batch_size=2, flush_interval=60)
+    await recorder.start()
+
+    await recorder.record("a")
+    await recorder.record("b")
+    await asyncio.sleep(0.01)
+    assert len(repo.batches) == 1
+
+    await recorder.record("c")
+    await recorder.stop()
+    assert [code for code, *_ in repo.batches[-1]] == ["c"]
+
+
+@pytest.mark.asyncio
+async def test_stop_waits_for_batch_in_flight():
+    class SlowRepository(FakeRepository):
+        def __init__(self):
+            super().__init__()
+            self.writing = asyncio.Event()
+            self.release = asyncio.Event()
+
+        async def save_access_statistics_batch(self, records):
+            self.writing.set()
+            await self.release.wait()
+            await super().save_access_statistics_batch(records)
+
+    repo = SlowRepository()
+    recorder = ClickRecorder(repo, batch_size=2, flush_interval=60)
+    await recorder.start()
+
+    await recorder.record("a")
+    await recorder.record("b")
+    await repo.writing.wait()
+    await recorder.record("c")
+
+    stopping = asyncio.create_task(recorder.stop())
+    await asyncio.sleep(0.01)
+    assert not stopping.done()
+    repo.release.set()
+    await stopping
+    assert [[code for code, *_ in batch] for batch in repo.batches] == [["a", "b"], ["c"]]
+
+
+@pytest.mark.asyncio
+async def test_visitors_are_counted_after_write():
+    class FakeVisitorCounter:
+        def __init__(self):
+            self.records = []
+
+        async def add_many(self, records):
+            self.records += records
+
+    repo = FakeRepository()
+    visitor_counter = FakeVisitorCounter()
+    recorder = ClickRecorder(repo, batch_size=10, visitor_counter=visitor_counter)
+    await recorder.record("a", 42)
+    await recorder.record("b")
+
+    await recorder.flush()
+    assert [(code, visitor_hash) for code, _, visitor_hash in visitor_counter.records] == [("a", 42), ("b", None)]
@@ -0,0 +1,49 @@
+import pytest
+
+from codes import CodeAllocator, CodeScrambler, encode_base62, CODE_SPACE, CODE_LENGTH
+
+
+class FakeRepository:
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self.next_block = 0
+        self.reserved = 0
+
+    async def reserve_code_block(self):
+        block_start = self.next_block
+        self.next_block += self.block_size
+        self.reserved += 1
+        return block_start, self.block_size
+
+
+def test_encode_base62():
+    assert encode_base62(0) == "000000"
+    assert encode_base62(61) == "00000Z"
+    assert encode_base62(62) == "000010"
+    assert len(encode_base62(CODE_SPACE - 1)) == CODE_LENGTH
+    assert len(encode_base62(CODE_SPACE)) == CODE_LENGTH + 1
+
+
+def test_scrambler_is_a_permutation_of_the_code_space():
+    scrambler = CodeScrambler("secret")
+    scrambled = {scrambler.scramble(value) for value in range(20000)}
+
+    assert len(scrambled) == 20000
+    assert all(0 <= value < CODE_SPACE for value in scrambled)
+    assert scrambled != set(range(20000))
+
+
+def test_scrambler_depends_on_secret():
+    assert CodeScrambler("a").scramble(1) != CodeScrambler("b").scramble(1)
+
+
+@pytest.mark.asyncio
+async def test_allocator_reserves_blocks():
+    repo = FakeRepository(block_size=3)
+    allocator = CodeAllocator(repo, secret="secret")
+
+    codes = [await allocator.next_code() for _ in range(7)]
+
+    assert len(set(codes)) == 7
+    assert all(len(code) == CODE_LENGTH for code in codes)
+    assert repo.reserved == 3
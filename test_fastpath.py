@@ -0,0 +1,82 @@
+import pytest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from fastpath import RedirectFastPath
+from repository import PoolExhaustedError
+
+
+class FakeService:
+    def __init__(self, links):
+        self.links = links
+        self.clicks = []
+        self.client_ips = []
+
+    async def get_original_url(self, short_code, client_ip=None, user_agent=None):
+        if short_code == "overloaded":
+            raise PoolExhaustedError("pool exhausted")
+        full_link = self.links.get(short_code)
+        if full_link is not None:
+            self.clicks.append(short_code)
+            self.client_ips.append(client_ip)
+        return full_link
+
+
+@pytest.fixture
+def service():
+    return FakeService({"abc": "http://test_link.com/path?q=привет"})
+
+
+@pytest.fixture
+def client(service):
+    inner = FastAPI()
+
+    @inner.get('/links/{short_code}/stats')
+    async def get_stats(short_code: str):
+        return {"short_url": short_code}
+
+    @inner.put('/links/{short_code}')
+    async def update_link(short_code: str):
+        return {"message": "Link has been updated"}
+
+    return TestClient(RedirectFastPath(inner, service, retry_after='2'), follow_redirects=False)
+
+
+def test_redirect(client, service):
+    response = client.get('/links/abc')
+    assert response.status_code == 302
+    assert response.headers['location'] == "http://test_link.com/path?q=%D0%BF%D1%80%D0%B8%D0%B2%D0%B5%D1%82"
+    assert service.clicks == ["abc"]
+
+
+def test_unknown_link(client, service):
+    response = client.get('/links/unknown')
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Link not found"}
+    assert service.clicks == []
+
+
+def test_overloaded(client):
+    response = client.get('/links/overloaded')
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '2'
+
+
+def test_other_routes_reach_the_app(client, service):
+    assert client.get('/links/abc/stats').json() == {"short_url": "abc"}
+    assert client.put('/links/abc').json() == {"message": "Link has been updated"}
+    assert client.get('/links/').status_code == 404
+    assert service.clicks == []
+
+
+def test_forwarded_client_ip(service):
+    headers = {'X-Forwarded-For': '198.51.100.1, 203.0.113.7, 10.0.0.1'}
+    one_proxy = TestClient(RedirectFastPath(FastAPI(), service, trusted_proxies=1), follow_redirects=False)
+    two_proxies = TestClient(RedirectFastPath(FastAPI(), service, trusted_proxies=2), follow_redirects=False)
+    untrusted = TestClient(RedirectFastPath(FastAPI(), service), follow_redirects=False)
+
+    assert one_proxy.get('/links/abc', headers=headers).status_code == 302
+    assert two_proxies.get('/links/abc', headers=headers).status_code == 302
+    assert untrusted.get('/links/abc', headers=headers).status_code == 302
+    assert service.client_ips == ["10.0.0.1", "203.0.113.7", "testclient"]
@@ -0,0 +1,54 @@
+import pytest
+
+from cache import LinkCache
+from hotkeys import SpaceSaving, HotLinkPinner
+
+
+def test_space_saving_finds_heavy_hitters():
+    sketch = SpaceSaving(capacity=10)
+    for i in range(1000):
+        sketch.add("hot")
+        sketch.add(f"cold{i}")
+        if i % 2 == 0:
+            sketch.add("warm")
+
+    top = sketch.top(2)
+    assert [item for item, _, _ in top] == ["hot", "warm"]
+    for item, count, error in top:
+        assert count - error <= {"hot": 1000, "warm": 500}[item] <= count
+    assert len(sketch.counts) == 10
+
+    sketch.decay()
+    assert sketch.top(1)[0][1] == top[0][1] // 2
+
+
+class FakeRepository:
+    def __init__(self, links):
+        self.links = links
+
+    async def find_link_by_short_code(self, short_code):
+        full_link = self.links.get(short_code)
+        return {"full_link": full_link, "expires_in": None} if full_link is not None else None
+
+
+@pytest.mark.asyncio
+async def test_pinner_pins_and_refreshes_hot_links():
+    repo = FakeRepository({"hot": "http://hot.com", "cold": "http://cold.com"})
+    link_cache = LinkCache(max_size=10, ttl=5)
+    pinner = HotLinkPinner(link_cache, repo, capacity=10, top_k=5, min_hits=3, refresh_ahead=10)
+    link_cache.set("hot", "http://hot.com")
+    link_cache.set("cold", "http://cold.com")
+    for _ in range(5):
+        pinner.record("hot")
+    pinner.record("cold")
+
+    repo.links["hot"] = "http://hot.com/v2"
+    await pinner.update()
+    assert set(link_cache.pinned()) == {"hot"}
+    assert link_cache.get("hot") == "http://hot.com/v2"
+    assert [link["short_code"] for link in pinner.top() if link["pinned"]] == ["hot"]
+
+    pinner.sketch.decay(0)
+    await pinner.update()
+    assert link_cache.pinned() == {}
+    assert link_cache.get("hot") == "http://hot.com/v2"
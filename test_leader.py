@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+
+from leader import LeaderElection
+
+
+class FakeConnection:
+    def __init__(self, locks):
+        self.locks = locks
+        self.broken = False
+        self.closed = False
+
+    async def fetchval(self, query, *args):
+        if self.broken:
+            raise ConnectionError("connection lost")
+        return 1
+
+    async def close(self, timeout=None):
+        self.closed = True
+        self.locks.discard(self)
+
+
+class FakeRepository:
+    def __init__(self):
+        self.locks = set()
+        self.connections = []
+
+    async def open_connection(self):
+        conn = FakeConnection(self.locks)
+        self.connections.append(conn)
+        return conn
+
+    async def try_session_lock(self, conn, lock_id):
+        if self.locks:
+            return False
+        self.locks.add(conn)
+        return True
+
+
+@pytest.mark.asyncio
+async def test_single_leader_and_failover():
+    repo = FakeRepository()
+    events = []
+    first = LeaderElection(repo, lambda: events.append("first elected"), lambda: events.append("first demoted"), interval=0.01)
+    second = LeaderElection(repo, lambda: events.append("second elected"), lambda: events.append("second demoted"), interval=0.01)
+
+    await first.start()
+    await second.start()
+    assert first.is_leader
+    assert not second.is_leader
+
+    repo.connections[0].broken = True
+    await first._campaign()
+    assert not first.is_leader
+    assert repo.connections[0].closed
+
+    await first.stop()
+    await asyncio.sleep(0.05)
+    assert second.is_leader
+
+    await second.stop()
+    assert events == ["first elected", "first demoted", "second elected", "second demoted"]
+    assert not repo.locks
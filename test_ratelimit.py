@@ -0,0 +1,167 @@
+import math
+import pytest
+
+from ratelimit import RateLimit, RateLimitRule, RateLimiter, RateLimitMiddleware
+
+
+class FakeRedis:
+    def __init__(self):
+        self.now = 1000.0
+        self.buckets = {}
+        self.calls = 0
+        self.available = True
+
+    def register_script(self, script):
+        async def run(keys, args):
+            self.calls += 1
+            if not self.available:
+                raise ConnectionError("redis is down")
+            buckets = []
+            for i, key in enumerate(keys):
+                rate, burst, requested = args[i * 3:i * 3 + 3]
+                tokens, ts = self.buckets.get(key, (burst, self.now))
+                tokens = min(burst, tokens + max(0, self.now - ts) * rate)
+                buckets.append((key, rate, tokens, min(requested, math.floor(tokens))))
+            denied = any(granted == 0 for *_, granted in buckets)
+            results = []
+            for key, rate, tokens, granted in buckets:
+                retry_after_ms = math.ceil((1 - tokens) / rate * 1000) if granted == 0 else 0
+                if not denied:
+                    self.buckets[key] = (tokens - granted, self.now)
+                results.append([0 if denied else granted, retry_after_ms])
+            return results
+        return run
+
+
+def make_rule(**limits):
+    return RateLimitRule('create', 'POST', limits, paths=('/links/shorten',))
+
+
+@pytest.mark.asyncio
+async def test_leases_are_spent_locally():
+    redis = FakeRedis()
+    limiter = RateLimiter(redis, lease_fraction=0.5, lease_seconds=10)
+    rule = make_rule(ip=RateLimit(10, 10))
+
+    for _ in range(5):
+        assert await limiter.check(rule, {'ip': '10.0.0.1'}) == 0
+    assert redis.calls == 1
+
+    for _ in range(5):
+        assert await limiter.check(rule, {'ip': '10.0.0.1'}) == 0
+    assert redis.calls == 2
+
+    retry_after = await limiter.check(rule, {'ip': '10.0.0.1'})
+    assert retry_after == pytest.approx(1.0)
+    assert redis.calls == 3
+
+    assert await limiter.check(rule, {'ip': '10.0.0.1'}) > 0
+    assert redis.calls == 3
+    assert await limiter.check(rule, {'ip': '10.0.0.2'}) == 0
+
+
+@pytest.mark.asyncio
+async def test_every_scope_has_its_own_budget():
+    redis = FakeRedis()
+    limiter = RateLimiter(redis, lease_fraction=0)
+    rule = make_rule(user=RateLimit(2, 60), ip=RateLimit(100, 60))
+
+    assert await limiter.check(rule, {'user': '1', 'ip': '10.0.0.1'}) == 0
+    assert await limiter.check(rule, {'user': '1', 'ip': '10.0.0.2'}) == 0
+    assert await limiter.check(rule, {'user': '1', 'ip': '10.0.0.3'}) > 0
+    assert await limiter.check(rule, {'user': '2', 'ip': '10.0.0.1'}) == 0
+    assert await limiter.check(rule, {'ip': '10.0.0.1'}) == 0
+
+
+@pytest.mark.asyncio
+async def test_rejected_request_does_not_spend_other_scopes():
+    redis = FakeRedis()
+    limiter = RateLimiter(redis, lease_fraction=0)
+    rule = make_rule(user=RateLimit(1, 60), ip=RateLimit(2, 60))
+
+    assert await limiter.check(rule, {'user': '1', 'ip': '10.0.0.1'}) == 0
+    assert await limiter.check(rule, {'user': '1', 'ip': '10.0.0.1'}) > 0
+    assert await limiter.check(rule, {'user': '1', 'ip': '10.0.0.1'}) > 0
+    assert await limiter.check(rule, {'user': '2', 'ip': '10.0.0.1'}) == 0
+    assert await limiter.check(rule, {'user': '3', 'ip': '10.0.0.1'}) > 0
+
+    limiter = RateLimiter(FakeRedis(), lease_fraction=0.5, lease_seconds=10)
+    rule = make_rule(user=RateLimit(1, 60), ip=RateLimit(10, 10))
+    ip_key = 'ratelimit:create:ip:10.0.0.1'
+    assert await limiter.check(rule, {'user': '1', 'ip': '10.0.0.1'}) == 0
+    assert limiter.leases[ip_key][0] == 4
+    assert await limiter.check(rule, {'user': '1', 'ip': '10.0.0.1'}) > 0
+    assert await limiter.check(rule, {'user': '1', 'ip': '10.0.0.1'}) > 0
+    assert limiter.leases[ip_key][0] == 4
+    assert await limiter.check(rule, {'user': '2', 'ip': '10.0.0.1'}) == 0
+    assert limiter.leases[ip_key][0] == 3
+
+
+@pytest.mark.asyncio
+async def test_unavailable_redis_fails_open():
+    redis = FakeRedis()
+    redis.available = False
+    limiter = RateLimiter(redis, error_backoff=60)
+    rule = make_rule(ip=RateLimit(1, 60))
+
+    assert await limiter.check(rule, {'ip': '10.0.0.1'}) == 0
+    assert await limiter.check(rule, {'ip': '10.0.0.1'}) == 0
+    assert redis.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_middleware_rejects_with_retry_after():
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope['path'])
+
+    async def authenticate(user_id, token):
+        return {'id': user_id} if token == f"token{user_id}" else None
+
+    limiter = RateLimiter(FakeRedis(), lease_fraction=0)
+    middleware = RateLimitMiddleware(app, limiter, [make_rule(user=RateLimit(1, 30))], authenticate=authenticate)
+    scope = {
+        'type': 'http', 'method': 'POST', 'path': '/links/shorten',
+        'headers': [(b'x-user-id', b'1'), (b'authorization', b'Bearer token1')], 'client': ('10.0.0.1', 50000),
+    }
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware(scope, None, send)
+    await middleware(scope, None, send)
+    await middleware({**scope, 'path': '/search', 'method': 'GET'}, None, send)
+
+    assert calls == ['/links/shorten', '/search']
+    assert messages[0]['status'] == 429
+    assert (b'retry-after', b'30') in messages[0]['headers']
+
+
+@pytest.mark.asyncio
+async def test_user_budget_requires_a_valid_token():
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope['client'][0])
+
+    async def authenticate(user_id, token):
+        return {'id': user_id} if token == f"token{user_id}" else None
+
+    async def send(message):
+        pass
+
+    limiter = RateLimiter(FakeRedis(), lease_fraction=0)
+    middleware = RateLimitMiddleware(app, limiter, [make_rule(user=RateLimit(1, 30))], authenticate=authenticate)
+    forged = {
+        'type': 'http', 'method': 'POST', 'path': '/links/shorten',
+        'headers': [(b'x-user-id', b'1'), (b'authorization', b'Bearer wrong')], 'client': ('10.0.0.2', 50000),
+    }
+    genuine = {**forged, 'headers': [(b'x-user-id', b'1'), (b'authorization', b'Bearer token1')], 'client': ('10.0.0.1', 50000)}
+
+    await middleware(forged, None, send)
+    await middleware(forged, None, send)
+    await middleware(genuine, None, send)
+    await middleware(genuine, None, send)
+    assert calls == ['10.0.0.2', '10.0.0.2', '10.0.0.1']
@@ -0,0 +1,109 @@
+import pytest
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from response_cache import ResponseCache, link_tag, user_tag
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.sets = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+            self.sets.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, key, value, ex=None):
+        self.commands.append(lambda: self.redis.values.__setitem__(key, value))
+
+    def sadd(self, key, member):
+        self.commands.append(lambda: self.redis.sets.setdefault(key, set()).add(member))
+
+    def expire(self, key, seconds):
+        self.commands.append(lambda: None)
+
+    def smembers(self, key):
+        self.commands.append(lambda: set(self.redis.sets.get(key, set())))
+
+    async def execute(self):
+        return [command() for command in self.commands]
+
+
+@pytest.fixture
+def client_and_cache():
+    response_cache = ResponseCache(FakeRedis())
+    calls = {"stats": 0, "search": 0}
+    app = FastAPI()
+
+    @app.get('/links/{short_code}/stats')
+    @response_cache.cached(expire=60, per_user=True, tags=lambda params, content: [link_tag(params['short_code'])])
+    async def get_stats(short_code: str, request: Request):
+        calls["stats"] += 1
+        return {"short_url": short_code, "user": request.headers['X-User-Id']}
+
+    @app.get('/search')
+    @response_cache.cached(expire=60)
+    async def search(request: Request, original_url: str):
+        calls["search"] += 1
+        if original_url == "missing":
+            raise HTTPException(status_code=404, detail="Link not found")
+        return {"short_links": ["abc"]}
+
+    return TestClient(app), response_cache, calls
+
+
+def headers(user_id):
+    return {"X-User-Id": str(user_id), "Authorization": f"Bearer token{user_id}"}
+
+
+def test_per_user_responses_are_not_shared(client_and_cache):
+    client, _, calls = client_and_cache
+
+    assert client.get('/links/abc/stats', headers=headers(1)).json() == {"short_url": "abc", "user": "1"}
+    assert client.get('/links/abc/stats', headers=headers(1)).json() == {"short_url": "abc", "user": "1"}
+    assert client.get('/links/abc/stats', headers=headers(2)).json() == {"short_url": "abc", "user": "2"}
+    assert calls["stats"] == 2
+
+
+def test_query_is_part_of_the_key_and_errors_are_not_cached(client_and_cache):
+    client, _, calls = client_and_cache
+
+    client.get('/search', params={"original_url": "http://a.com"})
+    client.get('/search', params={"original_url": "http://a.com"})
+    client.get('/search', params={"original_url": "http://b.com"})
+    assert calls["search"] == 2
+
+    assert client.get('/search', params={"original_url": "missing"}).status_code == 404
+    assert client.get('/search', params={"original_url": "missing"}).status_code == 404
+    assert calls["search"] == 4
+
+
+@pytest.mark.asyncio
+async def test_invalidate_by_tag(client_and_cache):
+    client, response_cache, calls = client_and_cache
+
+    client.get('/links/abc/stats', headers=headers(1))
+    client.get('/links/abc/stats', headers=headers(2))
+    await response_cache.invalidate_tags([link_tag("abc")])
+    client.get('/links/abc/stats', headers=headers(1))
+    assert calls["stats"] == 3
+
+    await response_cache.invalidate_tags([user_tag(1)])
+    client.get('/links/abc/stats', headers=headers(1))
+    client.get('/links/abc/stats', headers=headers(2))
+    assert calls["stats"] == 5
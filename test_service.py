@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+
+from datetime import timedelta
+
+from cache import LinkCache
+from service import Service
+
+
+class FakeRepository:
+    def __init__(self, links):
+        self.links = links
+        self.lookups = 0
+        self.release = asyncio.Event()
+
+    async def find_link_by_short_code(self, short_code):
+        self.lookups += 1
+        await self.release.wait()
+        full_link = self.links.get(short_code)
+        return {"full_link": full_link, "expires_in": None} if full_link is not None else None
+
+    async def get_top_links(self, limit, window):
+        return [
+            {"short_link": short_link, "full_link": full_link, "expires_in": None}
+            for short_link, full_link in list(self.links.items())[:limit]
+        ]
+
+
+@pytest.fixture
+def make_service(monkeypatch):
+    def make(repo):
+        monkeypatch.setattr(Service, "_instance", None)
+        return Service(repo, LinkCache(max_size=10, ttl=60))
+    return make
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_are_coalesced(make_service):
+    repo = FakeRepository({"abc": "http://test_link.com"})
+    service = make_service(repo)
+
+    lookups = [asyncio.create_task(service._resolve_short_code("abc")) for _ in range(10)]
+    await asyncio.sleep(0)
+    repo.release.set()
+
+    assert await asyncio.gather(*lookups) == ["http://test_link.com"] * 10
+    assert repo.lookups == 1
+    assert service.link_loads == {}
+    assert await service._resolve_short_code("abc") == "http://test_link.com"
+    assert repo.lookups == 1
+
+
+@pytest.mark.asyncio
+async def test_invalidation_during_load_is_not_overwritten(make_service):
+    repo = FakeRepository({"abc": "http://old_link.com"})
+    service = make_service(repo)
+
+    lookup = asyncio.create_task(service._resolve_short_code("abc"))
+    await asyncio.sleep(0)
+    await service.invalidate_links(["abc"])
+    repo.links["abc"] = "http://new_link.com"
+    repo.release.set()
+
+    await lookup
+    assert await service._resolve_short_code("abc") == "http://new_link.com"
+    assert repo.lookups == 2
+
+
+@pytest.mark.asyncio
+async def test_warm_up_fills_link_cache(make_service):
+    repo = FakeRepository({f"code{i}": f"http://test_link.com/{i}" for i in range(20)})
+    service = make_service(repo)
+
+    assert await service.warm_up_link_cache(100, timedelta(hours=24)) == 10
+    assert await service._resolve_short_code("code0") == "http://test_link.com/0"
+    assert await service._resolve_short_code("code9") == "http://test_link.com/9"
+    assert repo.lookups == 0
@@ -0,0 +1,23 @@
+from urls import canonicalize_url, url_hash
+
+
+def test_canonicalize_scheme_host_and_port():
+    assert canonicalize_url("HTTP://Example.COM:80") == "http://example.com/"
+    assert canonicalize_url("https://example.com:443/") == "https://example.com/"
+    assert canonicalize_url("https://example.com:8443/") == "https://example.com:8443/"
+
+
+def test_canonicalize_path_and_query():
+    assert canonicalize_url("https://example.com/a/b/") == "https://example.com/a/b"
+    assert canonicalize_url("https://example.com/a/?b=2&a=1&a=0") == "https://example.com/a?a=0&a=1&b=2"
+    assert canonicalize_url("https://example.com/A/Path") == "https://example.com/A/Path"
+
+
+def test_canonicalize_keeps_unparseable_urls():
+    assert canonicalize_url(" example.com/a ") == "example.com/a"
+
+
+def test_url_hash():
+    assert url_hash("http://a.com/") == url_hash("HTTP://a.com")
+    assert url_hash("http://a.com/x") != url_hash("http://a.com/y")
+    assert -2 ** 63 <= url_hash("http://a.com/") < 2 ** 63
@@ -0,0 +1,85 @@
+import pytest
+
+from datetime import date, datetime
+
+from visitors import UniqueVisitorCounter
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def pfadd(self, key, *values):
+        self.commands.append(lambda: self.redis.sets.setdefault(key, set()).update(values))
+
+    def expire(self, key, seconds):
+        self.commands.append(lambda: self.redis.ttls.__setitem__(key, seconds))
+
+    def pfcount(self, *keys):
+        self.commands.append(lambda: len(set().union(*(self.redis.sets.get(key, set()) for key in keys))))
+
+    async def execute(self):
+        return [command() for command in self.commands]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.sets = {}
+        self.ttls = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def pfcount(self, *keys):
+        return len(set().union(*(self.sets.get(key, set()) for key in keys)))
+
+
+@pytest.mark.asyncio
+async def test_daily_and_total_counts_merge():
+    redis = FakeRedis()
+    counter = UniqueVisitorCounter(redis, secret='secret', daily_ttl_days=1, total_ttl_days=2)
+    alice = counter.visitor_hash("10.0.0.1", "Firefox")
+    bob = counter.visitor_hash("10.0.0.2", "Firefox")
+    assert alice == counter.visitor_hash("10.0.0.1", "Firefox")
+    assert alice != counter.visitor_hash("10.0.0.1", "Chrome")
+
+    await counter.add_many([
+        ("abc", datetime(2025, 1, 1, 10, 0), alice),
+        ("abc", datetime(2025, 1, 1, 11, 0), alice),
+        ("abc", datetime(2025, 1, 2, 9, 0), alice),
+        ("abc", datetime(2025, 1, 2, 9, 5), bob),
+        ("abc", datetime(2025, 1, 2, 9, 6), None),
+        ("other", datetime(2025, 1, 2, 9, 0), bob),
+    ])
+
+    assert await counter.count("abc") == 2
+    assert await counter.count("missing") == 0
+    assert await counter.count_days("abc", date(2025, 1, 1), date(2025, 1, 3)) == {
+        "days": [
+            {"day": "2025-01-01", "unique_visitors": 1},
+            {"day": "2025-01-02", "unique_visitors": 2},
+            {"day": "2025-01-03", "unique_visitors": 0},
+        ],
+        "unique_visitors": 2,
+    }
+    assert redis.ttls["visitors:total:abc"] == 2 * 86400
+    assert redis.ttls["visitors:day:20250101:abc"] == 86400
+
+
+@pytest.mark.asyncio
+async def test_counts_are_none_when_redis_fails():
+    class BrokenPipeline(FakePipeline):
+        async def execute(self):
+            raise ConnectionError("redis is down")
+
+    class BrokenRedis(FakeRedis):
+        def pipeline(self, transaction=True):
+            return BrokenPipeline(self)
+
+        async def pfcount(self, *keys):
+            raise ConnectionError("redis is down")
+
+    counter = UniqueVisitorCounter(BrokenRedis())
+    assert await counter.count("abc") is None
+    assert await counter.count_days("abc", date(2025, 1, 1), date(2025, 1, 3)) is None
@@ -0,0 +1,40 @@
+import hashlib
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, quote
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonicalize_url(url: str) -> str:
+    url = url.strip()
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.netloc:
+        return url
+
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        return urlunsplit((scheme, parts.netloc.lower(), parts.path, parts.query, parts.fragment))
+
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host:
+        host = f"[{host}]"
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f"{parts.username}:{parts.password}"
+        host = f"{userinfo}@{host}"
+
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/') or '/'
+
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)), quote_via=quote)
+
+    return urlunsplit((scheme, host, path, query, parts.fragment))
+
+
+def url_hash(url: str) -> int:
+    digest = hashlib.sha256(canonicalize_url(url).encode()).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
@@ -0,0 +1,78 @@
+import hashlib
+import logging
+
+from datetime import date, timedelta
+from typing import Iterable, Optional
+
+logging.basicConfig(level=logging.INFO)
+
+MAX_VISITOR_DAYS = 366
+
+
+class UniqueVisitorCounter:
+    def __init__(self, redis, secret: str = '', daily_ttl_days: float = 90, total_ttl_days: float = 365,
+                 prefix: str = 'visitors:'):
+        self.redis = redis
+        self.secret = hashlib.blake2b(secret.encode()).digest()
+        self.daily_ttl = int(daily_ttl_days * 86400)
+        self.total_ttl = int(total_ttl_days * 86400)
+        self.prefix = prefix
+
+
+    def visitor_hash(self, client_ip: str, user_agent: Optional[str]) -> int:
+        digest = hashlib.blake2b(f"{client_ip}\n{user_agent or ''}".encode(), key=self.secret, digest_size=8).digest()
+        return int.from_bytes(digest, 'big', signed=True)
+
+
+    def _total_key(self, short_code: str) -> str:
+        return f"{self.prefix}total:{short_code}"
+
+
+    def _day_key(self, short_code: str, day: date) -> str:
+        return f"{self.prefix}day:{day:%Y%m%d}:{short_code}"
+
+
+    async def add_many(self, records: Iterable[tuple]):
+        visitors = {}
+        for short_code, access_date, visitor_hash in records:
+            if visitor_hash is None:
+                continue
+            visitors.setdefault((self._total_key(short_code), self.total_ttl), set()).add(visitor_hash)
+            visitors.setdefault((self._day_key(short_code, access_date.date()), self.daily_ttl), set()).add(visitor_hash)
+        if not visitors:
+            return
+
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for (key, ttl), hashes in visitors.items():
+                pipeline.pfadd(key, *hashes)
+                pipeline.expire(key, ttl)
+            await pipeline.execute()
+        except Exception:
+            logging.exception(f"Не удалось обновить счётчики уникальных посетителей для {len(visitors)} ключей")
+
+
+    async def count(self, short_code: str) -> Optional[int]:
+        try:
+            return await self.redis.pfcount(self._total_key(short_code))
+        except Exception:
+            logging.exception(f"Не удалось получить число уникальных посетителей ссылки {short_code}")
+            return None
+
+
+    async def count_days(self, short_code: str, start: date, end: date) -> Optional[dict]:
+        days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        keys = [self._day_key(short_code, day) for day in days]
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for key in keys:
+                pipeline.pfcount(key)
+            pipeline.pfcount(*keys)
+            *counts, total = await pipeline.execute()
+        except Exception:
+            logging.exception(f"Не удалось получить число уникальных посетителей ссылки {short_code} по дням")
+            return None
+        return {
+            "days": [{"day": day.isoformat(), "unique_visitors": count} for day, count in zip(days, counts)],
+            "unique_visitors": total,
+        }